@@ -1,14 +1,123 @@
 from PIL import Image, ImageDraw, ImageFont
 from pdf2image import convert_from_path
+from functools import lru_cache
 import os
 
 
+# Encoding profiles for the filled-out form.
+# "mode" is the PIL mode the page is converted to before saving and
+# "options" are passed straight to Image.save for that format.
+OUTPUT_PROFILES = {
+    "jpeg": {
+        "format": "JPEG",
+        "mode": "RGB",
+        "options": {"quality": 85, "optimize": True, "progressive": True, "subsampling": "4:2:0"},
+    },
+    "jpeg_gray": {
+        "format": "JPEG",
+        "mode": "L",
+        "options": {"quality": 80, "optimize": True, "progressive": True},
+    },
+    "png": {
+        "format": "PNG",
+        "mode": "RGB",
+        "options": {"compress_level": 6},
+    },
+    "png_gray": {
+        "format": "PNG",
+        "mode": "L",
+        "options": {"compress_level": 6},
+    },
+    "png_1bit": {
+        "format": "PNG",
+        "mode": "1",
+        "options": {"compress_level": 9},
+    },
+    "pdf": {
+        "format": "PDF",
+        "mode": "RGB",
+        "options": {},
+    },
+    "pdf_gray": {
+        "format": "PDF",
+        "mode": "L",
+        "options": {},
+    },
+}
+
+MIMETYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "PDF": "application/pdf",
+}
+
+EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "PDF": "pdf",
+}
+
+
+@lru_cache(maxsize=16)
+def _load_font(font_path, font_size):
+    """Resolve a font once per process; truetype() re-reads the font file on every call."""
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        # Fallback if font file is missing
+        return ImageFont.load_default()
+
+
 class Generator:
-    def __init__(self, font_path="arial.ttf", font_size=30, poppler_path=None):
+    def __init__(self, font_path="arial.ttf", font_size=30, poppler_path=None,
+                 output_profile="jpeg", quality=None, compress_level=None,
+                 delivery_dpi=None, render_dpi=300):
+        if output_profile not in OUTPUT_PROFILES:
+            raise ValueError(
+                f"Unknown output profile: {output_profile}. Supported: {', '.join(OUTPUT_PROFILES)}"
+            )
+
         self.font_size = font_size
         self.font_path = font_path
         self.poppler_path = poppler_path
 
+        self.output_profile = output_profile
+        self.render_dpi = render_dpi
+        self.delivery_dpi = delivery_dpi
+
+        profile = OUTPUT_PROFILES[output_profile]
+        self.output_format = profile["format"]
+        self.output_mode = profile["mode"]
+        self.save_options = dict(profile["options"])
+
+        if quality is not None and self.output_format == "JPEG":
+            self.save_options["quality"] = quality
+        if compress_level is not None and self.output_format == "PNG":
+            self.save_options["compress_level"] = compress_level
+
+    def load_font(self):
+        return _load_font(self.font_path, self.font_size)
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.output_format]
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.output_format]
+
+    @property
+    def settings(self):
+        """Everything besides the template and profile that changes the output bytes."""
+        return {
+            "font_path": self.font_path,
+            "font_size": self.font_size,
+            "output_profile": self.output_profile,
+            "save_options": self.save_options,
+            "render_dpi": self.render_dpi,
+            "delivery_dpi": self.delivery_dpi,
+        }
+
     def _load_image(self, template_path):
         """
         Load image from file path, handling both images and PDFs.
@@ -19,23 +128,28 @@ class Generator:
         ext = template_path.lower().split(".")[-1]
         
         if ext == "pdf":
-            # Convert PDF to images
+            # Only the first page is filled, so only that one is rendered;
+            # in colour only when the output format keeps it
             pages = convert_from_path(
                 template_path,
-                dpi=300,
+                dpi=self.render_dpi,
+                first_page=1,
+                last_page=1,
+                grayscale=self.output_mode in ("L", "1"),
                 poppler_path=self.poppler_path
             )
             
             if not pages:
                 raise ValueError(f"No pages found in PDF: {template_path}")
             
-            if len(pages) > 1:
-                print(f"Warning: PDF has {len(pages)} pages. Using only the first page.")
-            
             return pages[0]  # Return first page as PIL Image
         
         elif ext in ("jpg", "jpeg", "png", "bmp", "tiff"):
-            return Image.open(template_path)
+            image = Image.open(template_path)
+            if self.output_mode in ("L", "1"):
+                # JPEG decodes straight to grayscale, skipping the chroma planes
+                image.draft("L", image.size)
+            return image
         
         else:
             raise ValueError(f"Unsupported file format: {ext}. Supported: jpg, jpeg, png, pdf")
@@ -47,7 +161,8 @@ class Generator:
         :param template_path: Path to the blank form (image or PDF)
         :param mappings: List of dicts from the Parser ({section, label, fill_target...})
         :param user_profile: Dict containing user data ({'Patient Information_Full Name': 'John Doe'})
-        :param output_path: Where to save the result
+        :param output_path: Where to save the result (a path or a writable binary file object)
+        :return: output_path on success, None if the template could not be loaded
         """
 
         try:
@@ -59,6 +174,10 @@ class Generator:
             print(f"Error loading template: {e}")
             return
         
+        # Drawing needs a mode ImageDraw understands; 1-bit is applied at encode time
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("L" if self.output_mode in ("L", "1") else "RGB")
+
         draw = ImageDraw.Draw(image)
 
         for item in mappings:
@@ -74,23 +193,48 @@ class Generator:
                 print(f"Warning: No data found for field '{clean_key}'")
 
         # Save the result
-        image.save(output_path)
+        self._encode(image, output_path)
         print(f"Generated form saved to: {output_path}")
+        return output_path
+
+    def _encode(self, image, output_path):
+        """
+        Downscale to the delivery DPI, convert to the profile's mode and save.
+
+        :param image: Filled-out PIL image at render_dpi
+        :param output_path: Path or writable binary file object
+        """
+        if self.delivery_dpi and self.delivery_dpi < self.render_dpi:
+            scale = self.delivery_dpi / self.render_dpi
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            # reducing_gap does a fast integer box reduction first, then a small resample
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        if self.output_mode == "1":
+            # Plain threshold instead of dithering keeps scanned-style forms crisp and small
+            image = image.convert("L").point(lambda v: 255 if v >= 160 else 0).convert("1", dither=Image.Dither.NONE)
+        elif image.mode != self.output_mode:
+            image = image.convert(self.output_mode)
+
+        dpi = self.delivery_dpi if self.delivery_dpi and self.delivery_dpi < self.render_dpi else self.render_dpi
+        options = dict(self.save_options)
+        if self.output_format == "PDF":
+            options["resolution"] = float(dpi)
+        else:
+            options["dpi"] = (dpi, dpi)
+
+        image.save(output_path, format=self.output_format, **options)
 
     def _draw_text(self, draw_surface, box, text):
         """
         Helper to calculate position and font size, then draw.
         """
         x, y, w, h = box['x'], box['y'], box['w'], box['h']
-        
-        try:
-            font = ImageFont.truetype(self.font_path, self.font_size)
-        except IOError:
-            # Fallback if font file is missing
-            font = ImageFont.load_default()
 
-        # Simple vertical centering calculation
-        text_x = x + 25
+        font = self.load_font()
+
+        # Simple vertical centering calculation (25px margin at 300 DPI)
+        text_x = x + round(25 * self.render_dpi / 300)
         text_y = y + (h - self.font_size) // 2
         
         draw_surface.text((text_x, text_y), text, fill="black", font=font)
\ No newline at end of file
@@ -1,14 +1,15 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import os
 import pytesseract
 from pytesseract import Output
 from dotenv import load_dotenv
 import numpy as np
 import cv2
+import re
 from textwrap import dedent
 
-from Parser import Parser
-from Generator import Generator
+from pdf_layer import extract_words, extract_field_spaces
+import mosaic
 
 class Token:
     def __init__(self, id, type, value, bbox, page=0):
@@ -24,10 +25,21 @@ class Token:
 
 class Tokenizer:
 
-    def __init__(self, file_path, poppler_path=None):
+    def __init__(self, file_path, poppler_path=None, text_layer=True, vector_layer=True, dpi=300,
+                 grayscale=False, ocr_batching=False):
         self.file_path = file_path
         self.poppler_path  = poppler_path
+        self.text_layer = text_layer  # read words from the PDF text layer, OCR only pages without one
+        self.vector_layer = vector_layer  # read field boxes from PDF drawing operators instead of pixels
+        self.dpi = dpi
+        # The pixel thresholds below are tuned for 300 DPI and scaled to the render DPI
+        self.scale = dpi / 300
+        # Render/decode straight to one 8-bit channel, shared by OCR and line detection
+        self.grayscale = grayscale
+        # OCR the text regions of all pages through a few mosaic images (see mosaic.py)
+        self.ocr_batching = ocr_batching
         self.img = None
+        self.vector_pages = None  # set by detect_field_spaces
 
     def __str__(self):
         return dedent(f"""Tokenizer: 
@@ -44,8 +56,19 @@ class Tokenizer:
             return ext
 
     def _pil_to_cv(self, pil_img):
+        if pil_img.mode == "L":
+            # Already single channel: one buffer copy, no colour conversion
+            return np.asarray(pil_img)
         return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+
+    def _imread(self):
+        flag = cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR
+        return cv2.imread(self.file_path, flag)
     
+    def _px(self, length):
+        """A length in 300-DPI pixels, in this tokenizer's pixels."""
+        return max(1, round(length * self.scale))
+
     def _get_dimensions(self):
         """Returns (height, width) of the last processed image"""
         if self.img is not None:
@@ -61,23 +84,55 @@ class Tokenizer:
         page_offset_y = 0
 
         if ext == "pdf":
-            pages = convert_from_path(
-                self.file_path,
-                300,
-                poppler_path=self.poppler_path
-            )
+            # Born-digital PDFs carry their words and lines already; reading them takes
+            # milliseconds, against seconds for rasterizing + OCR + morphology
+            text_pages = None
+            if self.text_layer:
+                text_pages = extract_words(self.file_path, self.dpi, self.poppler_path)
+
+            # The vector pass also flags scanned pages, whose text layer (a stamp, a Bates
+            # number) doesn't stand for the scanned labels
+            vector_pages = None
+            if self.vector_layer or self.text_layer:
+                vector_pages = extract_field_spaces(self.file_path, self.dpi)
+
+            # Only rasterize up front when we have to; otherwise pages are rendered on demand
+            pages = None
+            if output_path is not None or (text_pages is None and vector_pages is None):
+                pages = convert_from_path(
+                    self.file_path,
+                    self.dpi,
+                    grayscale=self.grayscale,
+                    poppler_path=self.poppler_path
+                )
+            n_pages = len(pages) if pages is not None else len(vector_pages or text_pages)
 
             # if len(pages) > 1:
             #     raise()
-            
-            for page_index, page in enumerate(pages):
-                self.img = self._pil_to_cv(page)
-                if self.img is not None:
-                    page_height, page_width = self._get_dimensions()
-                    dimensions.append((page_height, page_width))
+
+            # First pass: everything each page offers without OCR
+            page_images = []
+            page_data = []
+            page_boxes = []
+            for page_index in range(n_pages):
+                page = pages[page_index] if pages is not None else None
+
+                data = self._text_layer_data(text_pages, page_index, self._is_scanned(vector_pages, page_index))
+                boxes = self._vector_layer_boxes(vector_pages, page_index) if self.vector_layer else None
+
+                img = None
+                if data is None or boxes is None or page is not None:
+                    if page is None:
+                        page = self._render_page(page_index)
+                    img = self._pil_to_cv(page)
+                    page_height, page_width = img.shape[:2]
+                else:
+                    page_height = vector_pages[page_index]["height"]
+                    page_width = vector_pages[page_index]["width"]
+                dimensions.append((page_height, page_width))
 
                 if output_path is not None:
-                    n = len(pages)
+                    n = n_pages
                     # Get the base filename without the path or extension
                     base_name = os.path.basename(self.file_path).split(".")[0]
                     
@@ -92,23 +147,45 @@ class Tokenizer:
                     # Save using the 'destination' path, not the folder 'output_path'
                     page.save(destination, 'PNG')
 
-                data = pytesseract.image_to_data(
-                    self.img,
-                    output_type=Output.DICT
-                )
+                page_images.append(img)
+                page_data.append(data)
+                page_boxes.append(boxes)
+
+            # Scanned or image-only pages: fall back to OCR
+            missing = [i for i in range(n_pages) if page_data[i] is None]
+            if self.ocr_batching and missing:
+                for page_index, data in zip(missing, mosaic.ocr_pages([page_images[i] for i in missing], scale=self.scale)):
+                    page_data[page_index] = data
+
+            for page_index in range(n_pages):
+                self.img = page_images[page_index]
+                data = page_data[page_index]
+                boxes = page_boxes[page_index]
+                page_height, page_width = dimensions[page_index]
+
+                if data is None:
+                    data = pytesseract.image_to_data(
+                        self.img,
+                        output_type=Output.DICT
+                    )
 
                 textual_tokens = self._process_ocr_data(
                     data,
                     width=page_width,
-                    page=page
+                    page=page_index
                 )
 
-                visual_tokens = self._get_visual_token(self.img, page)
+                if boxes is None:
+                    # No usable vector content (e.g. a scanned page): detect lines in pixels
+                    visual_tokens = self._get_visual_token(self.img, page_index)
+                else:
+                    visual_tokens = self._boxes_to_tokens(boxes, page_index)
  
                 page_tokens = self._merge_and_sort(
                     textual_tokens,
                     visual_tokens
                 )
+                page_images[page_index] = None  # done with this page's pixels
 
                 # Apply Y offset so pages don't overlap
                 for t in page_tokens:
@@ -121,16 +198,19 @@ class Tokenizer:
             return all_tokens, dimensions
 
         else:  # meaning if the file uploaded is not pdf then use OpenCV
-            self.img = cv2.imread(self.file_path)
+            self.img = self._imread()
             
             if self.img is not None:
                 page_height, page_width = self._get_dimensions()
                 dimensions.append((page_height, page_width))
 
-            data = pytesseract.image_to_data(
-                self.img,
-                output_type=Output.DICT
-            )
+            if self.ocr_batching:
+                data = mosaic.ocr_pages([self.img], scale=self.scale)[0]
+            else:
+                data = pytesseract.image_to_data(
+                    self.img,
+                    output_type=Output.DICT
+                )
 
             textual_tokens = self._process_ocr_data(
                 data,
@@ -146,6 +226,111 @@ class Tokenizer:
 
             return final_tokens, dimensions
 
+    def detect_field_spaces(self):
+        """
+        Only the FIELD_SPACE tokens and page dimensions, without any OCR. Boxes are in the
+        same stacked-page coordinates as tokenize_file. Used to align a known template.
+        """
+        ext = self._check_extension(self.file_path)
+
+        if ext != "pdf":
+            self.img = self._imread()
+            page_height, page_width = self._get_dimensions()
+            return self._get_visual_token(self.img), [(page_height, page_width)]
+
+        vector_pages = extract_field_spaces(self.file_path, self.dpi) if self.vector_layer else None
+        self.vector_pages = vector_pages
+        if vector_pages is None:
+            n_pages = pdfinfo_from_path(self.file_path, poppler_path=self.poppler_path)["Pages"]
+        else:
+            n_pages = len(vector_pages)
+
+        all_tokens = []
+        dimensions = []
+        page_offset_y = 0
+
+        for page_index in range(n_pages):
+            boxes = self._vector_layer_boxes(vector_pages, page_index)
+            if boxes is None:
+                self.img = self._pil_to_cv(self._render_page(page_index))
+                page_height, page_width = self._get_dimensions()
+                page_tokens = self._get_visual_token(self.img, page_index)
+            else:
+                page_height = vector_pages[page_index]["height"]
+                page_width = vector_pages[page_index]["width"]
+                page_tokens = self._boxes_to_tokens(boxes, page_index)
+            dimensions.append((page_height, page_width))
+
+            for t in page_tokens:
+                x, y, w, h = t.bbox
+                t.bbox = (x, y + page_offset_y, w, h)
+
+            all_tokens.extend(page_tokens)
+            page_offset_y += page_height
+
+        return all_tokens, dimensions
+
+    def text_layer_words(self):
+        """
+        Lower-cased words of each page's text layer, None for pages without one (scans).
+        Returns None for images, or when the text layer is off or unreadable. No OCR.
+        Call after detect_field_spaces, whose vector pass tells scans apart.
+        """
+        if not self.text_layer or self._check_extension(self.file_path) != "pdf":
+            return None
+
+        text_pages = extract_words(self.file_path, self.dpi, self.poppler_path)
+        if text_pages is None:
+            return None
+
+        page_words = []
+        for page_index in range(len(text_pages)):
+            data = self._text_layer_data(text_pages, page_index, self._is_scanned(self.vector_pages, page_index))
+            if data is None:
+                page_words.append(None)
+            else:
+                page_words.append({word for text in data["text"] for word in re.findall(r"\w+", text.lower())})
+        return page_words
+
+    def _render_page(self, page_index):
+        """Rasterize a single PDF page (1-based in Poppler)."""
+        return convert_from_path(
+            self.file_path,
+            self.dpi,
+            first_page=page_index + 1,
+            last_page=page_index + 1,
+            grayscale=self.grayscale,
+            poppler_path=self.poppler_path
+        )[0]
+
+    def _vector_layer_boxes(self, vector_pages, page_index):
+        """
+        FIELD_SPACE boxes of one page from its drawing operators, or None when the page
+        has to go through the OpenCV path (scanned page, rotated page, unreadable PDF).
+        """
+        if not vector_pages or page_index >= len(vector_pages) or vector_pages[page_index] is None:
+            return None
+        return vector_pages[page_index]["boxes"]
+
+    def _is_scanned(self, vector_pages, page_index):
+        """True if the vector pass found the page to be mostly one image."""
+        if not vector_pages or page_index >= len(vector_pages) or vector_pages[page_index] is None:
+            return False
+        return vector_pages[page_index].get("scanned", False)
+
+    def _text_layer_data(self, text_pages, page_index, scanned=False):
+        """
+        Words of one page from the PDF text layer, in Tesseract's image_to_data layout.
+        Returns None when the page has no text layer, or is a scan, so the caller OCRs it instead.
+        """
+        if scanned or not text_pages or page_index >= len(text_pages):
+            return None
+
+        data = text_pages[page_index]["data"]
+        if not any(text.strip() for text in data["text"]):
+            return None
+        return data
+
     def _process_ocr_data(self, data, width, page=0, gap_threshold=27):
         """
         Groups Tesseract words into lines based on Block+Paragraph+Line
@@ -199,7 +384,7 @@ class Tokenizer:
                 gap = word['left'] - last_word_right
                 
                 # DECISION: Is this a new field on the same line?
-                if gap > gap_threshold:
+                if gap > gap_threshold * self.scale:
                     # YES: The gap is huge (e.g., between "Name:" and "Phone:")
                     # 1. Save the previous phrase as a complete token
                     
@@ -294,7 +479,7 @@ class Tokenizer:
         median_h = np.median(heights)
 
         PAGE_WIDTH = width
-        TOP_REGION = 350  # Stricter threshold for top of page
+        TOP_REGION = 350 * self.scale  # Stricter threshold for top of page
 
         def is_form_title(t, notes, median_h):
             """Form title is the topmost element that's prominent"""
@@ -302,7 +487,7 @@ class Tokenizer:
             topmost_y = min(note.bbox[1] for note in notes)
             
             # Check if this token is the topmost one (or very close to it)
-            is_topmost = abs(t.bbox[1] - topmost_y) < 50  # Allow 50px tolerance
+            is_topmost = abs(t.bbox[1] - topmost_y) < 50 * self.scale  # Allow 50px tolerance
             
             return (
                 is_topmost and                                # Must be at the top
@@ -339,17 +524,20 @@ class Tokenizer:
     def _get_visual_token(self, img, page=0):
 
         # img = cv2.imread(self.file_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if img.ndim == 2:
+            gray = img  # grayscale pipeline: use the OCR buffer as is
+        else:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
         # binary image (invert so lines are white)
         _, bw = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
 
         # Detect horizontal lines
-        h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (40, 1))
+        h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (self._px(40), 1))
         h_lines = cv2.morphologyEx(bw, cv2.MORPH_OPEN, h_kernel)
 
         # Detect vertical lines
-        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 40))
+        v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, self._px(40)))
         v_lines = cv2.morphologyEx(bw, cv2.MORPH_OPEN, v_kernel)
 
         # Combine lines
@@ -358,26 +546,34 @@ class Tokenizer:
         # Find contours
         contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        visual_tokens = []
+        boxes = []
         for cnt in contours:
             x, y, w, h = cv2.boundingRect(cnt)
-            if w > 100 and h > 5:
-                # Store as a dictionary or object to match your Token style
-                # visual_tokens.append({
-                #     'type': 'FIELD_SPACE', # or CHECKBOX depending on shape
-                #     'value': '____',
-                #     'x': x, 'y': y, 'w': w, 'h': h
-                # })
-
-                visual_tokens.append(
-                    Token(
-                        id = 4,
-                        type = "FIELD_SPACE",
-                        value = "____",
-                        bbox = (x, y, w, h),
-                        page=page
-                    )
+            if w > 100 * self.scale and h > 5 * self.scale:
+                boxes.append((x, y, w, h))
+
+        return self._boxes_to_tokens(boxes, page)
+
+    def _boxes_to_tokens(self, boxes, page=0):
+        """Turn (x, y, w, h) field boxes, from pixels or PDF vectors, into sorted FIELD_SPACE tokens."""
+        visual_tokens = []
+        for x, y, w, h in boxes:
+            # Store as a dictionary or object to match your Token style
+            # visual_tokens.append({
+            #     'type': 'FIELD_SPACE', # or CHECKBOX depending on shape
+            #     'value': '____',
+            #     'x': x, 'y': y, 'w': w, 'h': h
+            # })
+
+            visual_tokens.append(
+                Token(
+                    id = 4,
+                    type = "FIELD_SPACE",
+                    value = "____",
+                    bbox = (x, y, w, h),
+                    page=page
                 )
+            )
 
         # CRITICAL STEP: SORT BY Y (Top-to-Bottom), THEN X (Left-to-Right)
         # We use y // 10 to allow for slight "wobble" in alignment (Row Clustering)
@@ -408,7 +604,7 @@ class Tokenizer:
             
             # 3. Check Vertical Distance
             # If this token is within 'row_tolerance' pixels of the current row's Y...
-            if abs(token.bbox[1] - current_row_y) <= row_tolerance:
+            if abs(token.bbox[1] - current_row_y) <= row_tolerance * self.scale:
                 current_row.append(token)
                 
                 # Optional: Update average Y (moving average) to follow the line's drift
@@ -434,10 +630,31 @@ class Tokenizer:
         
         return final_stream
 
+    def _stacked_pages(self):
+        """All pages rendered and stacked top to bottom, matching the tokens' page offsets."""
+        pages = [
+            self._pil_to_cv(page)
+            for page in convert_from_path(
+                self.file_path, self.dpi, grayscale=self.grayscale, poppler_path=self.poppler_path
+            )
+        ]
+        width = max(page.shape[1] for page in pages)
+        padded = []
+        for page in pages:
+            pad = [(0, 0), (0, width - page.shape[1])] + [(0, 0)] * (page.ndim - 2)
+            padded.append(np.pad(page, pad, constant_values=255))
+        return np.vstack(padded)
+
     def _visualize_file(self, tokens, img=None):
 
-        if img == None:
+        if img is None:
             img = self.img
+        if img is None:
+            # The text/vector layers never rasterized the page(s); render them for the drawing
+            img = self._stacked_pages()
+        if img.ndim == 2:
+            # Grayscale pipeline: colour copy just for the debug drawing
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
         # DO NOT reload the image inside the loop
         for t in tokens:
             x, y, w, h = t.bbox
@@ -477,6 +694,9 @@ class Tokenizer:
         cv2.imwrite("../detections/final_detected1.jpg", img)
 
 def main():
+    from Parser import Parser
+    from Generator import Generator
+
     # path = "../forms/personal_data_sheet.pdf"
     # path = "../forms/bg_verification_form.pdf"
     # path = "../forms/employment_application_form.pdf"
@@ -1,44 +1,66 @@
+import io
 import os
+import time
 from flask import Flask, render_template, session, request, send_file
 from werkzeug.utils import secure_filename
 
-from Token import Tokenizer
-from Parser import Parser
-from Generator import Generator
-import pytesseract
-
 from dotenv import load_dotenv
 
+import database
+import output_cache
+import preflight
+import profiling
+import readiness
+import scheduler
+import template_library
+import upload_store
+from cache import LRUCache
+from database import KEY_MAPPING
+
 load_dotenv()
 
 POPPLER_PATH = os.getenv("POPPLER_PATH")
 
+# Output encoding (see Generator.OUTPUT_PROFILES)
+OUTPUT_PROFILE = os.getenv("OUTPUT_PROFILE", "jpeg")
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY")) if os.getenv("OUTPUT_QUALITY") else None
+OUTPUT_COMPRESS_LEVEL = int(os.getenv("OUTPUT_COMPRESS_LEVEL")) if os.getenv("OUTPUT_COMPRESS_LEVEL") else None
+OUTPUT_DPI = int(os.getenv("OUTPUT_DPI")) if os.getenv("OUTPUT_DPI") else None
+
+# Cap on concurrent OCR jobs in this process so /process can't oversubscribe cores.
+# The gunicorn config divides the cores between its workers through this variable.
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", os.cpu_count() or 1))
+JOB_QUEUE_TIMEOUT = float(os.getenv("JOB_QUEUE_TIMEOUT", "30"))
+# Waiting jobs are admitted smallest first; each second of waiting counts as this many megapixels less.
+# The largest job preflight lets through must age past newly arriving jobs within the queue timeout,
+# otherwise a steady stream of small forms turns it away with a 503 every time.
+MAX_JOB_MEGAPIXELS = max(preflight.MAX_DOCUMENT_MEGAPIXELS, preflight.MAX_IMAGE_MEGAPIXELS)
+JOB_AGING_RATE = float(os.getenv(
+    "JOB_AGING_RATE",
+    str(max(scheduler.DEFAULT_PAGE_MEGAPIXELS, MAX_JOB_MEGAPIXELS / JOB_QUEUE_TIMEOUT))
+))
+if JOB_AGING_RATE * JOB_QUEUE_TIMEOUT < MAX_JOB_MEGAPIXELS:
+    raise ValueError(
+        f"JOB_AGING_RATE={JOB_AGING_RATE:g} is too low for JOB_QUEUE_TIMEOUT={JOB_QUEUE_TIMEOUT:g}: "
+        f"a {MAX_JOB_MEGAPIXELS:g} MP job could never get ahead of new jobs before timing out "
+        f"(needs at least {MAX_JOB_MEGAPIXELS / JOB_QUEUE_TIMEOUT:g})"
+    )
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "1024"))
+
+# Render/decode pages as 8-bit grayscale for OCR and line detection (colour isn't used there)
+GRAYSCALE_PIPELINE = os.getenv("GRAYSCALE_PIPELINE", "1") == "1"
+
+# OCR scanned pages through a few packed mosaics of their text regions (see mosaic.py)
+OCR_BATCHING = os.getenv("OCR_BATCHING", "0") == "1"
+
+# Generated forms are kept on disk, keyed by (template, profile, settings); 0 disables
+OUTPUT_CACHE_MB = int(os.getenv("OUTPUT_CACHE_MB", "256"))
+
+# Reuse the mappings of previously parsed forms for re-scans/re-exports of the same form
+TEMPLATE_LIBRARY = os.getenv("TEMPLATE_LIBRARY", "1") == "1"
+
 tesseract_path = os.getenv("PYTESSERACT_PATH")
-if tesseract_path:
-    pytesseract.pytesseract.tesseract_cmd = tesseract_path
-
-KEY_MAPPING = {
-    "fullName": "Full Name",
-    "dateOfBirth": "Date of Birth",
-    "gender": "Gender",
-    "nationality": "Nationality",
-    "email": "Email Address",
-    "phone": "Phone Number",
-    "alternatePhone": "Alternate Phone Number",
-    "address": "Address",
-    "employer": "Current Employer",
-    "position": "Job Title",
-    "monthlySalary": "Monthly Salary",
-    "experience": "experience",
-    "sssNumber": "SSS Number",
-    "tinNumber": "TIN Number",
-    "philhealthNumber": "PhilHealth Number",
-    "pagibigNumber": "Pag-IBIG Number",
-    "educationLevel": "Highest Education Level",
-    "school": "School",
-    "course": "Course/Program",
-    "yearGraduated": "Year Graduated"
-}
 
 
 # --------------------
@@ -61,14 +83,111 @@ app.secret_key = "my_secret_key"
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploaded_files")
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "pdf"}
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# Whole request, form overhead included; the file itself is capped while it is saved
+app.config["MAX_CONTENT_LENGTH"] = int(preflight.MAX_UPLOAD_MB * 1024 * 1024) + 64 * 1024
+
+OUTPUT_CACHE_FOLDER = os.getenv("OUTPUT_CACHE_FOLDER", os.path.join(BASE_DIR, "output_cache"))
+
+
+jobs = scheduler.JobScheduler(MAX_CONCURRENT_JOBS, JOB_AGING_RATE)
+
+# Profiles live in the users table; the session only carries their opaque key
+database.init_db()
+profile_cache = LRUCache(PROFILE_CACHE_SIZE)
+templates = template_library.TemplateLibrary()
+outputs = output_cache.OutputCache(OUTPUT_CACHE_FOLDER, OUTPUT_CACHE_MB * 1024 * 1024)
+# Uploads are stored once per content hash, which also keys the caches below
+uploads = upload_store.UploadStore(UPLOAD_FOLDER, outputs)
+plans = LRUCache(PROFILE_CACHE_SIZE)
+
+
+def load_pipeline():
+    """
+    Import the OCR/vision stack (cv2, numpy, pytesseract, pdf2image, PIL) on first use,
+    so routes that don't process documents never pay for it.
+
+    :return: (Tokenizer, Parser, Generator) classes
+    """
+    from Token import Tokenizer
+    from Parser import Parser
+    from Generator import Generator
+    import pytesseract
+
+    if tesseract_path:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_path
+
+    return Tokenizer, Parser, Generator
+
+
+def warm_up():
+    """
+    Load the pipeline ahead of the first request. gunicorn calls this in the
+    master before forking; it is a no-op once the modules are imported.
+    """
+    load_pipeline()
+
+
+def start_readiness():
+    """Kick off the synthetic warm-up pass that /readyz reports on (once per process)."""
+    readiness.start(
+        load_pipeline,
+        POPPLER_PATH,
+        tokenizer_options={"grayscale": GRAYSCALE_PIPELINE, "ocr_batching": OCR_BATCHING},
+        make_generator=make_generator
+    )
 
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def current_profile():
+    """Read-through lookup of the session's profile: worker cache first, then SQLite."""
+    profile_key = session.get("profile_id")
+    if not profile_key:
+        return None
+
+    profile = profile_cache.get(profile_key)
+    if profile is None:
+        profile = database.load_profile(profile_key)
+        if profile is not None:
+            profile_cache.put(profile_key, profile)
+    return profile
+
+
+def make_generator(dpi=preflight.RENDER_DPI):
+    _, _, Generator = load_pipeline()
+    return Generator(
+        font_size=round(30 * dpi / preflight.RENDER_DPI),
+        render_dpi=dpi,
+        poppler_path=POPPLER_PATH,
+        output_profile=OUTPUT_PROFILE,
+        quality=OUTPUT_QUALITY,
+        compress_level=OUTPUT_COMPRESS_LEVEL,
+        delivery_dpi=OUTPUT_DPI
+    )
+
+
+def current_upload():
+    """(path, content hash) of the session's upload; the hash is None for documents stored by path."""
+    document_id = session.get("document_id")
+    if document_id is None:
+        return None, None
+    return database.load_document(document_id) or (None, None)
+
+
+def plan_for(path, content_hash):
+    """preflight.check, remembered per content hash."""
+    if content_hash is None:
+        return preflight.check(path)
+    plan = plans.get(content_hash)
+    if plan is None:
+        plan = preflight.check(path)
+        plans.put(content_hash, plan)
+    return plan
+
+
 # --------------------
 # Routes
 # --------------------
@@ -81,6 +200,23 @@ def landing():
     return render_template("landing.html")
 
 
+@app.route("/healthz")
+def healthz():
+    # Liveness only: the process is up and serving requests
+    return {"status": "ok"}, 200
+
+@app.route("/readyz")
+def readyz():
+    start_readiness()
+    ready, report = readiness.status()
+    return report, 200 if ready else 503
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return {"error": f"File is larger than {preflight.MAX_UPLOAD_MB:g} MB"}, 413
+
+
 @app.route("/upload", methods=["POST"])
 def upload():
     file = request.files.get("document")
@@ -90,11 +226,27 @@ def upload():
     if not allowed_file(file.filename):
         return {"error": "Invalid file type"}, 400
 
-    filename = secure_filename(file.filename)
-    save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(save_path)
+    uploads.start_gc()
 
-    session["save_path"] = os.path.abspath(save_path)
+    filename = secure_filename(file.filename)
+    ext = file.filename.rsplit(".", 1)[1].lower()
+    try:
+        # Hashed while it streams in; an identical file already stored is reused
+        content_hash, path = uploads.save(file.stream, ext, check=preflight.check)
+    except preflight.PreflightError as e:
+        return {"error": str(e)}, e.status
+
+    # The reference taken by save() now belongs to this document
+    try:
+        document_id = database.save_document(os.path.abspath(path), content_hash)
+    except Exception:
+        uploads.release(content_hash, ext)
+        raise
+    previous = session.get("document_id")
+    if previous is not None:
+        database.delete_document(previous)
+
+    session["document_id"] = document_id
     session.modified = True
 
     return {"status": "ok", "filename": filename}, 200
@@ -103,31 +255,50 @@ def upload():
 
 @app.route("/submit", methods=["POST"])
 def submit_profile():
-    data = request.get_json()
-    if not data:
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
         return {"error": "No data received"}, 400
 
-    # Map keys to what Generator expects
-    session["user_data"] = {KEY_MAPPING[k]: v for k, v in data.items() if k in KEY_MAPPING}
+    # Map keys to what Generator expects; every field is stored and drawn as text
+    user_data = {}
+    for k, v in data.items():
+        if k not in KEY_MAPPING or v is None:
+            continue
+        if isinstance(v, (dict, list)):
+            return {"error": f"Field '{k}' must be a string"}, 400
+        user_data[KEY_MAPPING[k]] = str(v)
+
+    # Stored rows are immutable: a new submission gets a new key and the old row is dropped
+    profile_key = database.save_profile(user_data)
+    profile_cache.put(profile_key, user_data)
+    _drop_profile(session.get("profile_id"))
+
+    session["profile_id"] = profile_key
     session.modified = True
     return {"status": "ok"}, 200
 
 @app.route("/clear_profile", methods=["POST"])
 def clear_profile():
-    session.pop("user_data", None)
+    _drop_profile(session.pop("profile_id", None))
     session.modified = True
     return {"status": "ok"}, 200
 
 @app.route("/get_profile")
 def get_profile():
-    return {"user_data": session.get("user_data")}
+    return {"user_data": current_profile()}
+
+
+def _drop_profile(profile_key):
+    if profile_key:
+        profile_cache.pop(profile_key)
+        database.delete_profile(profile_key)
 
 
 
 @app.route("/process", methods=["POST"])
 def process():
-    path = session.get("save_path")
-    user = session.get("user_data")
+    path, content_hash = current_upload()
+    user = current_profile()
 
     if not path or not os.path.exists(path):
         return {"errors": ["Uploaded file not found"]}, 400
@@ -135,42 +306,161 @@ def process():
     if not user:
         return {"errors": ["User data not submitted"]}, 400
 
-    # 1. Tokenize (PDF handled internally)
-    tokenizer = Tokenizer(path, poppler_path=POPPLER_PATH)
-    tokens, dimensions = tokenizer.tokenize_file()
+    if content_hash is None:
+        return _process(path, output_cache.file_digest(path), user)
 
-    # 2. Parse
-    parser = Parser()
-    accepted, errors = parser(tokens)
+    # The job holds its own reference so the file outlives a concurrent re-upload or expiry
+    ext = path.rsplit(".", 1)[-1].lower()
+    if not uploads.retain(content_hash, ext):
+        return {"errors": ["Uploaded file not found"]}, 400
+    try:
+        return _process(path, content_hash, user)
+    finally:
+        uploads.release(content_hash, ext)
+
+
+def _process(path, content_hash, user):
+    # Page count and sizes from metadata: reject or lower the DPI before anything is rendered
+    try:
+        plan = plan_for(path, content_hash)
+    except preflight.PreflightError as e:
+        return {"errors": [str(e)]}, e.status
+
+    gen = make_generator(plan.dpi)
+    profiled = profiling.requested(request.headers)
+
+    # Same template, profile and settings give the same bytes: answer from the ETag or the cache
+    key = output_key(content_hash, user, gen)
+    if not profiled:
+        if request.if_none_match.contains(key):
+            response = app.response_class(status=304)
+            response.set_etag(key)
+            return response
+
+        cached = outputs.get(key)
+        if cached is not None:
+            return _send_output(cached, gen, key)
+
+    # A profiled job runs alone: cProfile hooks every thread of the interpreter on 3.12+
+    if not jobs.acquire(plan.megapixels, timeout=JOB_QUEUE_TIMEOUT, exclusive=profiled):
+        return {"errors": ["Server is busy, please try again"]}, 503
+
+    try:
+        if not profiled:
+            # Rendered by another request while this one was queued?
+            cached = outputs.get(key)
+            if cached is not None:
+                return _send_output(cached, gen, key)
+
+        job = {"file": os.path.basename(path), "dpi": plan.dpi, "cost_megapixels": round(plan.megapixels, 1)}
+        if not profiled:
+            return _run_pipeline(path, content_hash, user, job, gen, key)
+
+        with profiling.JobProfile(job) as profile:
+            response = app.make_response(_run_pipeline(path, content_hash, user, job, gen, key))
+        if profile.captured:
+            response.headers["X-Profile-Id"] = profile.job_id
+        return response
+    finally:
+        jobs.release()
+
+
+def output_key(content_hash, user, gen):
+    """ETag / output cache key of processing the upload `content_hash` with `user` through `gen`."""
+    settings = dict(
+        gen.settings,
+        grayscale=GRAYSCALE_PIPELINE,
+        ocr_batching=OCR_BATCHING,
+        template_library=TEMPLATE_LIBRARY
+    )
+    return output_cache.output_key(content_hash, user, settings)
 
-    if not accepted:
-        return {"errors": errors}, 400
 
-    # 3. Generate filled form image
-    output_path = os.path.join(
-        os.path.dirname(path),
-        "filled_out_form.jpg"
+def _send_output(output, gen, key):
+    response = send_file(
+        output,
+        mimetype=gen.mimetype,
+        as_attachment=False,
+        download_name=f"filled_out_form.{gen.extension}",
+        etag=key
     )
+    # Per-user content: the browser may keep it but must revalidate, shared caches must not
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-    gen = Generator(poppler_path=POPPLER_PATH)
-    gen.generate(
+
+def _run_pipeline(path, content_hash, user, job, gen, key):
+    """
+    Tokenize, parse and generate. `job` collects counts for the profiling hook.
+    The output is stored in the output cache under `key`.
+    """
+    Tokenizer, Parser, _ = load_pipeline()
+
+    tokenizer = Tokenizer(
         path,
-        parser.mappings,
-        user,
-        output_path
+        poppler_path=POPPLER_PATH,
+        dpi=gen.render_dpi,
+        grayscale=GRAYSCALE_PIPELINE,
+        ocr_batching=OCR_BATCHING
     )
 
+    # 0. Known form? Then its stored mappings, aligned to this upload, replace OCR + parsing.
+    #    The very same file (at the same DPI) doesn't even need the fingerprint.
+    mappings = None
+    page_hashes = None
+    content_key = f"{content_hash}@{gen.render_dpi}@v{template_library.PIPELINE_VERSION}"
+    if TEMPLATE_LIBRARY:
+        mappings = templates.lookup_exact(content_key)
+        if mappings is None:
+            started = time.perf_counter()
+            page_hashes = template_library.fingerprint(path, POPPLER_PATH)
+            job["fingerprint_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            mappings = templates.lookup(page_hashes, tokenizer)
+    job["template_hit"] = mappings is not None
+
+    if mappings is None:
+        # 1. Tokenize (PDF handled internally)
+        tokens, dimensions = tokenizer.tokenize_file()
+        job["pages"] = len(dimensions)
+        job["tokens"] = len(tokens)
+
+        # 2. Parse
+        parser = Parser()
+        accepted, errors = parser(tokens)
+        job["accepted"] = accepted
+
+        if not accepted:
+            return {"errors": errors}, 400
+
+        mappings = parser.mappings
+        if TEMPLATE_LIBRARY:
+            templates.add(page_hashes, tokens, dimensions, mappings, content_key)
+
+    job["fields"] = len(mappings)
+
+    # 3. Generate filled form image (encoded in memory, no temp file round trip)
+    output = io.BytesIO()
+    if gen.generate(path, mappings, user, output) is None:
+        return {"errors": ["Could not generate the filled form"]}, 500
+    outputs.put(key, output.getvalue())
+    output.seek(0)
+
     # 4. Return image (NOT JSON)
-    return send_file(
-        output_path,
-        mimetype="image/jpeg",
-        as_attachment=False
-    )
+    return _send_output(output, gen, key)
 
 
 # --------------------
 # Main
 # --------------------
+# Development server only; production runs gunicorn with gunicorn.conf.py
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if os.getenv("WARMUP_ON_START", "1") == "1":
+        warm_up()
+        start_readiness()
+    app.run(
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5000")),
+        debug=os.getenv("FLASK_DEBUG", "1") == "1"
+    )
 
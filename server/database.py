@@ -1,9 +1,62 @@
+import json
+import os
+import secrets
 import sqlite3
+import time
 
-DB_NAME = "app.db"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_NAME = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "app.db"))
+
+# Profile label (as the Generator expects it) -> users column
+PROFILE_COLUMNS = {
+    "Full Name": "fullname",
+    "Date of Birth": "dateofbirth",
+    "Gender": "gender",
+    "Nationality": "nationality",
+    "Email Address": "email",
+    "Phone Number": "phone",
+    "Alternate Phone Number": "alternatephone",
+    "Address": "address",
+    "Highest Education Level": "education",
+    "School": "school",
+    "Course/Program": "course",
+    "Year Graduated": "yeargraduated",
+    "Current Employer": "employer",
+    "Job Title": "jobtitle",
+    "experience": "experience",
+    "Monthly Salary": "salary",
+    "SSS Number": "sss",
+    "TIN Number": "tin",
+    "PhilHealth Number": "philhealth",
+    "Pag-IBIG Number": "pagibig",
+}
+
+# Field names the front-end posts to /submit -> profile label
+KEY_MAPPING = {
+    "fullName": "Full Name",
+    "dateOfBirth": "Date of Birth",
+    "gender": "Gender",
+    "nationality": "Nationality",
+    "email": "Email Address",
+    "phone": "Phone Number",
+    "alternatePhone": "Alternate Phone Number",
+    "address": "Address",
+    "employer": "Current Employer",
+    "position": "Job Title",
+    "monthlySalary": "Monthly Salary",
+    "experience": "experience",
+    "sssNumber": "SSS Number",
+    "tinNumber": "TIN Number",
+    "philhealthNumber": "PhilHealth Number",
+    "pagibigNumber": "Pag-IBIG Number",
+    "educationLevel": "Highest Education Level",
+    "school": "School",
+    "course": "Course/Program",
+    "yearGraduated": "Year Graduated"
+}
 
 def get_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME, timeout=10)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -11,6 +64,9 @@ def init_db():
     conn = get_db()
     cur = conn.cursor()
 
+    # Several gunicorn workers share this file; WAL lets readers run alongside a writer
+    cur.execute("PRAGMA journal_mode=WAL")
+
     # User profile (stored once)
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
@@ -38,6 +94,17 @@ def init_db():
     )
     """)
 
+    # Opaque key the session carries instead of the profile itself
+    columns = {row["name"] for row in cur.execute("PRAGMA table_info(users)")}
+    if "profile_key" not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN profile_key TEXT")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_profile_key ON users(profile_key)")
+
+    # When the profile was submitted, so profiles of sessions that never came back expire
+    if "created_at" not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN created_at TIMESTAMP")
+        cur.execute("UPDATE users SET created_at = CURRENT_TIMESTAMP")
+
     # Uploaded / processed document
     cur.execute("""
     CREATE TABLE IF NOT EXISTS documents (
@@ -47,6 +114,25 @@ def init_db():
     )
     """)
 
+    # Content hash of the stored upload (see upload_store); older rows only have a path
+    columns = {row["name"] for row in cur.execute("PRAGMA table_info(documents)")}
+    if "content_hash" not in columns:
+        cur.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+
+    # One row per stored upload file, shared by every document with the same content and
+    # extension. refs counts the documents and running jobs using it; unreferenced files are collected.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS uploads (
+        content_hash TEXT,
+        ext TEXT,
+        path TEXT,
+        size INTEGER,
+        refs INTEGER DEFAULT 0,
+        last_used REAL,
+        PRIMARY KEY (content_hash, ext)
+    )
+    """)
+
     # Tokens from OCR
     cur.execute("""
     CREATE TABLE IF NOT EXISTS tokens (
@@ -78,5 +164,256 @@ def init_db():
     )
     """)
 
+    # Known form layouts (perceptual fingerprint + parsed mappings); content_key identifies
+    # the exact upload a template was learned from, pipeline_version the Tokenizer/Parser it came from
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        page_hashes TEXT,
+        layout TEXT,
+        dimensions TEXT,
+        mappings TEXT,
+        content_key TEXT,
+        pipeline_version INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
     conn.commit()
     conn.close()
+
+def save_profile(profile):
+    """
+    Store a profile and return the opaque key that identifies it.
+    Rows are never updated in place, so cached copies can't go stale.
+
+    :param profile: Dict keyed by the labels in PROFILE_COLUMNS
+    """
+    profile_key = secrets.token_urlsafe(16)
+    labels = [label for label in profile if label in PROFILE_COLUMNS]
+    columns = ["profile_key"] + [PROFILE_COLUMNS[label] for label in labels]
+    values = [profile_key] + [profile[label] for label in labels]
+
+    conn = get_db()
+    with conn:
+        conn.execute(
+            f"INSERT INTO users ({', '.join(columns)}, created_at) "
+            f"VALUES ({', '.join('?' * len(columns))}, CURRENT_TIMESTAMP)",
+            values
+        )
+    conn.close()
+    return profile_key
+
+def load_profile(profile_key):
+    """Return the profile stored under profile_key (keyed by label), or None."""
+    conn = get_db()
+    row = conn.execute("SELECT * FROM users WHERE profile_key = ?", (profile_key,)).fetchone()
+    conn.close()
+
+    if row is None:
+        return None
+    return {label: row[column] for label, column in PROFILE_COLUMNS.items() if row[column] is not None}
+
+def delete_profile(profile_key):
+    conn = get_db()
+    with conn:
+        conn.execute("DELETE FROM users WHERE profile_key = ?", (profile_key,))
+    conn.close()
+
+def expire_profiles(max_age):
+    """Delete profiles submitted more than max_age seconds ago. Returns the number removed."""
+    conn = get_db()
+    with conn:
+        cur = conn.execute(
+            "DELETE FROM users WHERE created_at < datetime('now', ?)", (f"-{int(max_age)} seconds",)
+        )
+    conn.close()
+    return cur.rowcount
+
+def save_document(path, content_hash=None):
+    """
+    Record an uploaded file and return its document id. With a content_hash the document
+    takes over a reference to that upload (see register_upload), released by delete_document.
+    """
+    conn = get_db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO documents (filename, content_hash) VALUES (?, ?)", (path, content_hash)
+        )
+    conn.close()
+    return cur.lastrowid
+
+def load_document(document_id):
+    """Return (path, content_hash) of a document, or None."""
+    conn = get_db()
+    row = conn.execute(
+        "SELECT filename, content_hash FROM documents WHERE id = ?", (document_id,)
+    ).fetchone()
+    conn.close()
+    return (row["filename"], row["content_hash"]) if row else None
+
+def delete_document(document_id):
+    """Forget a document and release its reference to the upload."""
+    conn = get_db()
+    with conn:
+        row = conn.execute(
+            "SELECT filename, content_hash FROM documents WHERE id = ?", (document_id,)
+        ).fetchone()
+        conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        if row and row["content_hash"]:
+            _release(conn, row["content_hash"], _extension(row["filename"]))
+    conn.close()
+
+def expire_documents(max_age):
+    """
+    Delete documents older than max_age seconds (sessions that never came back)
+    and release their uploads. Returns the number of documents removed.
+    """
+    conn = get_db()
+    with conn:
+        rows = conn.execute(
+            "SELECT id, filename, content_hash FROM documents WHERE processed_at < datetime('now', ?)",
+            (f"-{int(max_age)} seconds",)
+        ).fetchall()
+        for row in rows:
+            conn.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+            if row["content_hash"]:
+                _release(conn, row["content_hash"], _extension(row["filename"]))
+    conn.close()
+    return len(rows)
+
+def _extension(path):
+    return path.rsplit(".", 1)[-1].lower()
+
+def register_upload(content_hash, ext, path, size):
+    """Record a stored upload (or find the existing copy) and take a reference to it."""
+    conn = get_db()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO uploads (content_hash, ext, path, size, refs, last_used) VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT(content_hash, ext) DO UPDATE SET refs = refs + 1, last_used = excluded.last_used
+            """,
+            (content_hash, ext, path, size, time.time())
+        )
+    conn.close()
+
+def retain_upload(content_hash, ext):
+    """Take another reference to a stored upload. Returns False if it is gone."""
+    conn = get_db()
+    with conn:
+        cur = conn.execute(
+            "UPDATE uploads SET refs = refs + 1, last_used = ? WHERE content_hash = ? AND ext = ?",
+            (time.time(), content_hash, ext)
+        )
+    conn.close()
+    return cur.rowcount == 1
+
+def release_upload(content_hash, ext):
+    conn = get_db()
+    with conn:
+        _release(conn, content_hash, ext)
+    conn.close()
+
+def _release(conn, content_hash, ext):
+    conn.execute(
+        "UPDATE uploads SET refs = MAX(refs - 1, 0), last_used = ? WHERE content_hash = ? AND ext = ?",
+        (time.time(), content_hash, ext)
+    )
+
+def collect_uploads(grace, remove):
+    """
+    Delete uploads nobody has referenced for `grace` seconds.
+
+    :param remove: Called with the file path while the row is still locked, so a concurrent
+                   upload of the same content waits and then stores a fresh copy
+    :return: Number of uploads removed
+    """
+    conn = get_db()
+    candidates = conn.execute(
+        "SELECT content_hash, ext FROM uploads WHERE refs = 0 AND last_used < ?",
+        (time.time() - grace,)
+    ).fetchall()
+
+    removed = 0
+    for candidate in candidates:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT path FROM uploads WHERE content_hash = ? AND ext = ? AND refs = 0 AND last_used < ?",
+                (candidate["content_hash"], candidate["ext"], time.time() - grace)
+            ).fetchone()
+            if row is not None:
+                remove(row["path"])
+                conn.execute(
+                    "DELETE FROM uploads WHERE content_hash = ? AND ext = ?",
+                    (candidate["content_hash"], candidate["ext"])
+                )
+                removed += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    conn.close()
+    return removed
+
+def save_template(page_hashes, layout, dimensions, mappings, content_key=None, pipeline_version=None):
+    """
+    Store a recognised form layout so later uploads of the same form can skip OCR.
+
+    :param page_hashes: Perceptual hash (hex string) of each page
+    :param layout: FIELD_SPACE boxes [(x, y, w, h), ...] in the form's pixel space
+    :param dimensions: [(height, width), ...] per page
+    :param mappings: parser.mappings for the form
+    :param content_key: Identifies the exact file (and render DPI) the template was learned from
+    :param pipeline_version: Version of the pipeline that produced `mappings`
+    :return: template id
+    """
+    conn = get_db()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO templates (page_hashes, layout, dimensions, mappings, content_key, pipeline_version) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (json.dumps(page_hashes), json.dumps(layout), json.dumps(dimensions), json.dumps(mappings),
+             content_key, pipeline_version)
+        )
+    conn.close()
+    return cur.lastrowid
+
+def prune_templates(keep, pipeline_version=None):
+    """
+    Delete templates of other pipeline versions and all but the newest `keep` of the rest.
+    Returns the number removed.
+    """
+    conn = get_db()
+    with conn:
+        stale = conn.execute(
+            "DELETE FROM templates WHERE pipeline_version IS NOT ?", (pipeline_version,)
+        ).rowcount
+        cur = conn.execute(
+            "DELETE FROM templates WHERE id <= (SELECT id FROM templates ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (keep,)
+        )
+    conn.close()
+    return stale + cur.rowcount
+
+def load_templates(after_id=0, pipeline_version=None):
+    """Return stored templates of `pipeline_version` with id > after_id, oldest first."""
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT * FROM templates WHERE id > ? AND pipeline_version IS ? ORDER BY id",
+        (after_id, pipeline_version)
+    ).fetchall()
+    conn.close()
+
+    return [
+        {
+            "id": row["id"],
+            "page_hashes": json.loads(row["page_hashes"]),
+            "layout": [tuple(box) for box in json.loads(row["layout"])],
+            "dimensions": [tuple(dim) for dim in json.loads(row["dimensions"])],
+            "mappings": json.loads(row["mappings"]),
+            "content_key": row["content_key"],
+        }
+        for row in rows
+    ]
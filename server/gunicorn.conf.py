@@ -0,0 +1,66 @@
+"""
+Production server settings, used by the Docker image:
+
+    gunicorn --config server/gunicorn.conf.py app:app
+
+The app and the OCR/vision stack (loaded by app.warm_up) are imported once
+in the master and then forked, so every worker shares those pages copy-on-write instead of paying
+the import cost (and memory) itself.
+"""
+import gc
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CPU_COUNT = os.cpu_count() or 1
+
+chdir = BASE_DIR
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+# Tesseract and Poppler run as subprocesses and OpenCV releases the GIL,
+# so a few threaded workers keep the cores busy without many interpreters.
+workers = int(os.getenv("WEB_CONCURRENCY", min(4, CPU_COUNT)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so fragmentation from large page images doesn't accumulate
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "500"))
+max_requests_jitter = 50
+
+accesslog = "-"
+errorlog = "-"
+
+# Split the cores between workers for the /process concurrency cap (see app.py),
+# and keep Tesseract from starting its own OpenMP thread pool per job.
+os.environ.setdefault("MAX_CONCURRENT_JOBS", str(max(1, CPU_COUNT // workers)))
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def on_starting(server):
+    """Import the heavy modules in the master before any worker is forked."""
+    from app import warm_up
+
+    warm_up()
+
+
+def pre_fork(server, worker):
+    # Move everything imported so far out of the GC's reach, otherwise the
+    # first collection in each worker touches (and copies) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import cv2
+
+    # One OpenCV thread per job; parallelism comes from concurrent requests
+    cv2.setNumThreads(int(os.getenv("OPENCV_THREADS", "1")))
+
+    # Each worker warms its own Tesseract/Poppler/font state; /readyz turns green when done
+    if os.getenv("WARMUP_ON_START", "1") == "1":
+        from app import start_readiness
+
+        start_readiness()
@@ -0,0 +1,72 @@
+"""
+Measure how long importing a module takes in a fresh interpreter and fail
+when it goes over budget, so the OCR stack doesn't creep back into the
+import path of app.py.
+
+    python import_budget.py                   # app, budget from IMPORT_BUDGET_MS
+    python import_budget.py --module Token --budget-ms 2000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "400"))
+
+
+def measure(module, runs=3):
+    """
+    Import `module` in `runs` fresh interpreters with -X importtime.
+
+    :return: (best cumulative import time of `module` in ms, per-package times of that run)
+    """
+    best_ms, best_packages = None, {}
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+        packages = {}
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "imported package" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            packages[name.strip()] = int(cumulative) / 1000
+
+        total_ms = packages.get(module, 0.0)
+        if best_ms is None or total_ms < best_ms:
+            best_ms, best_packages = total_ms, packages
+
+    return best_ms, best_packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a module's cold import time against a budget")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    total_ms, packages = measure(args.module, args.runs)
+
+    top_level = {name: ms for name, ms in packages.items() if "." not in name and name != args.module}
+    print(f"Slowest imports under {args.module}:")
+    for name, ms in sorted(top_level.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    status = "OK" if total_ms <= args.budget_ms else "OVER BUDGET"
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms) {status}")
+    sys.exit(0 if total_ms <= args.budget_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Load test for the upload -> submit -> process flow.
+
+Each virtual user has its own cookie session and loops over: upload one of the
+forms in ../forms, submit a synthetic profile shaped like KEY_MAPPING, process.
+Reports throughput, p50/p95/p99 latency and error rate per endpoint, and the
+server's RSS over time (the server process plus its workers and OCR children).
+
+    # start the app locally under gunicorn and drive it with 8 users for 60s
+    python loadtest.py --spawn gunicorn --users 8 --duration 60
+
+    # cold mode: template library and output cache disabled, so every job runs the full pipeline
+    python loadtest.py --spawn gunicorn --cold --users 8 --duration 60
+
+    # against an already running app (pass its pid to sample RSS)
+    python loadtest.py --url http://127.0.0.1:5000 --server-pid 1234 --users 4
+
+The report states which mode ran. Against --url the mode is whatever that server was
+started with and is reported as "unknown".
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+import requests
+
+# database has no import-time side effects; importing app would create its folders and tables
+from database import KEY_MAPPING
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMS_DIR = os.path.join(BASE_DIR, "..", "forms")
+
+FIRST_NAMES = ["Juan", "Maria", "Jose", "Ana", "Mark", "Grace", "Paolo", "Liza"]
+LAST_NAMES = ["Dela Cruz", "Santos", "Reyes", "Garcia", "Mendoza", "Bautista"]
+CITIES = ["Quezon City", "Makati", "Pasig", "Cebu City", "Davao City"]
+
+
+def synthetic_profile(rng):
+    """A random profile using the same keys the front-end posts to /submit."""
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    values = {
+        "fullName": name,
+        "dateOfBirth": f"{rng.randint(1960, 2004)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "gender": rng.choice(["Male", "Female"]),
+        "nationality": "Filipino",
+        "email": f"{name.lower().replace(' ', '.')}@example.com",
+        "phone": f"+63 9{rng.randint(10, 99)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+        "alternatePhone": f"+63 9{rng.randint(10, 99)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+        "address": f"{rng.randint(1, 999)} Mabini Street, {rng.choice(CITIES)}",
+        "employer": rng.choice(["San Miguel Corporation", "Ayala Corporation", "Jollibee Foods"]),
+        "position": rng.choice(["Software Engineer", "Accountant", "Nurse"]),
+        "monthlySalary": f"PHP {rng.randint(20, 150) * 1000:,}",
+        "experience": str(rng.randint(0, 30)),
+        "sssNumber": f"{rng.randint(10, 99)}-{rng.randint(1000000, 9999999)}-{rng.randint(0, 9)}",
+        "tinNumber": f"{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(100, 999)}",
+        "philhealthNumber": f"{rng.randint(10, 99)}-{rng.randint(100000000, 999999999)}-{rng.randint(0, 9)}",
+        "pagibigNumber": f"{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+        "educationLevel": rng.choice(["College", "Masters"]),
+        "school": "University of the Philippines",
+        "course": rng.choice(["Computer Science", "Nursing", "Accountancy"]),
+        "yearGraduated": str(rng.randint(1980, 2024)),
+    }
+    return {key: value for key, value in values.items() if key in KEY_MAPPING}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Results:
+
+    def __init__(self):
+        self.samples = {"upload": [], "submit": [], "process": []}  # (started_at, seconds, ok)
+        self.errors = {}
+        self.flows = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, started, elapsed, ok, error=None):
+        with self._lock:
+            self.samples[step].append((started, elapsed, ok))
+            if error:
+                key = f"{step}: {error}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def flow_done(self):
+        with self._lock:
+            self.flows += 1
+
+
+def virtual_user(base_url, forms, results, stop_at, seed, timeout):
+    rng = random.Random(seed)
+    http = requests.Session()
+
+    def step(name, method, url, **kwargs):
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            response = http.request(method, url, timeout=timeout, **kwargs)
+            elapsed = time.perf_counter() - t0
+            ok = response.status_code == 200
+            results.record(name, started, elapsed, ok, None if ok else f"HTTP {response.status_code}")
+            return ok
+        except requests.RequestException as e:
+            results.record(name, started, time.perf_counter() - t0, False, type(e).__name__)
+            return False
+
+    while time.time() < stop_at:
+        form = rng.choice(forms)
+        with open(form, "rb") as f:
+            ok = step("upload", "POST", f"{base_url}/upload",
+                      files={"document": (os.path.basename(form), f, "application/pdf")})
+        ok = ok and step("submit", "POST", f"{base_url}/submit", json=synthetic_profile(rng))
+        ok = ok and step("process", "POST", f"{base_url}/process")
+        if ok:
+            results.flow_done()
+
+
+def sample_rss(pid, samples, stop_event, interval):
+    """Sum RSS of the server process and all its descendants every `interval` seconds."""
+    try:
+        root = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        return
+
+    while not stop_event.is_set():
+        total = 0
+        try:
+            for proc in [root] + root.children(recursive=True):
+                try:
+                    total += proc.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+        except psutil.NoSuchProcess:
+            return
+        samples.append((time.time(), total))
+        stop_event.wait(interval)
+
+
+def spawn_server(kind, port, cold=False):
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG="0", BIND=f"127.0.0.1:{port}")
+    if cold:
+        # Repeated uploads of the same forms would otherwise be answered from the caches
+        env.update(TEMPLATE_LIBRARY="0", OUTPUT_CACHE_MB="0")
+    if kind == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app:app"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    return subprocess.Popen(cmd, cwd=BASE_DIR, env=env)
+
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def summarize(results, rss, duration, mode):
+    report = {"mode": mode, "duration_s": round(duration, 1), "flows": results.flows,
+              "flows_per_s": round(results.flows / duration, 3) if duration else None,
+              "endpoints": {}, "errors": results.errors}
+
+    for step, samples in results.samples.items():
+        latencies = sorted(s[1] for s in samples)
+        failures = sum(1 for s in samples if not s[2])
+        report["endpoints"][step] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / duration, 3) if duration else None,
+            "error_rate": round(failures / len(samples), 4) if samples else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        }
+
+    if rss:
+        start = rss[0][0]
+        report["rss_mb"] = {
+            "start": round(rss[0][1] / 2**20, 1),
+            "peak": round(max(r[1] for r in rss) / 2**20, 1),
+            "end": round(rss[-1][1] / 2**20, 1),
+            "timeline": [(round(t - start, 1), round(r / 2**20, 1)) for t, r in rss],
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['mode']} mode: {report['flows']} complete flows in {report['duration_s']}s "
+          f"({report['flows_per_s']} flows/s)")
+    print(f"{'endpoint':<10}{'reqs':>8}{'rps':>9}{'err%':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, stats in report["endpoints"].items():
+        err = f"{stats['error_rate'] * 100:.1f}" if stats["error_rate"] is not None else "-"
+        print(f"{step:<10}{stats['requests']:>8}{stats['rps'] or 0:>9}{err:>8}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}")
+    for error, count in sorted(report["errors"].items(), key=lambda e: -e[1]):
+        print(f"  {count:>6} x {error}")
+    if "rss_mb" in report:
+        rss = report["rss_mb"]
+        print(f"server RSS: start {rss['start']} MB, peak {rss['peak']} MB, end {rss['end']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the upload -> submit -> process flow")
+    parser.add_argument("--url", default=None, help="Base URL of a running app")
+    parser.add_argument("--spawn", choices=["gunicorn", "flask"], help="Start the app locally first")
+    parser.add_argument("--port", type=int, default=5055, help="Port for --spawn")
+    parser.add_argument("--cold", action="store_true",
+                        help="With --spawn: disable the template library and output cache")
+    parser.add_argument("--server-pid", type=int, help="Pid to sample RSS from when not spawning")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent sessions")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--forms", default=os.path.join(FORMS_DIR, "*.pdf"), help="Glob of forms to upload")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout")
+    parser.add_argument("--rss-interval", type=float, default=1.0)
+    parser.add_argument("--report", help="Write the full report (with RSS timeline) as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    forms = sorted(glob.glob(args.forms))
+    if not forms:
+        parser.error(f"No forms match {args.forms}")
+
+    if args.cold and not args.spawn:
+        parser.error("--cold needs --spawn (set TEMPLATE_LIBRARY=0 OUTPUT_CACHE_MB=0 on the server yourself)")
+
+    server = None
+    if args.spawn:
+        server = spawn_server(args.spawn, args.port, cold=args.cold)
+        base_url = f"http://127.0.0.1:{args.port}"
+        pid = server.pid
+        mode = "cold" if args.cold else "warm"
+    elif args.url:
+        base_url = args.url.rstrip("/")
+        pid = args.server_pid
+        mode = "unknown"
+    else:
+        parser.error("Pass --url or --spawn")
+
+    try:
+        if not wait_until_ready(base_url, timeout=120):
+            print(f"{base_url} did not become ready", file=sys.stderr)
+            sys.exit(1)
+
+        rss, stop_event = [], threading.Event()
+        sampler = None
+        if pid:
+            sampler = threading.Thread(target=sample_rss, args=(pid, rss, stop_event, args.rss_interval), daemon=True)
+            sampler.start()
+
+        results = Results()
+        started = time.time()
+        stop_at = started + args.duration
+        users = [
+            threading.Thread(target=virtual_user,
+                             args=(base_url, forms, results, stop_at, args.seed + i, args.timeout))
+            for i in range(args.users)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        duration = time.time() - started
+
+        stop_event.set()
+        if sampler:
+            sampler.join()
+
+        report = summarize(results, rss, duration, mode)
+        print_report(report)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
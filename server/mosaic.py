@@ -0,0 +1,193 @@
+"""
+Batch many small OCR regions into a few Tesseract calls.
+
+Every pytesseract call starts a tesseract process and loads the language model,
+which dominates when a form is mostly short labels next to boxes. Instead, the
+text regions of all pages are found with a cheap blob detection, cropped, packed
+side by side into a few large mosaic images and OCR'd once per mosaic. Word boxes
+are mapped back to their page coordinates and returned in image_to_data's layout,
+so Tokenizer._process_ocr_data consumes them unchanged.
+
+Tesseract's own line numbers don't survive the repacking (neighbouring crops share
+mosaic lines, one label may span two crops), so words are regrouped into lines by
+their position on the page.
+"""
+import cv2
+import numpy as np
+import pytesseract
+from pytesseract import Output
+
+OCR_KEYS = ("text", "conf", "left", "top", "width", "height", "block_num", "par_num", "line_num")
+
+
+def find_text_regions(img, padding=8, join_gap=28, line_kernel=40, max_height=300):
+    """
+    Bounding boxes (x, y, w, h) of text lines on a page.
+
+    Dark pixels are thresholded like _get_visual_token, form lines (runs longer than
+    `line_kernel`) are removed so a box doesn't swallow the label inside it, and the
+    remaining ink is smeared horizontally by `join_gap` (the phrase gap used by
+    _process_ocr_data) so the words of a phrase form one blob. Only a 3px vertical
+    smear is used so separate lines stay apart. Padded boxes that overlap are merged
+    so no word is read twice.
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, bw = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY_INV)
+
+    h_lines = cv2.morphologyEx(bw, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (line_kernel, 1)))
+    v_lines = cv2.morphologyEx(bw, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, line_kernel)))
+    ink = cv2.subtract(bw, cv2.add(h_lines, v_lines))
+
+    blobs = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (join_gap, 3)))
+    contours, _ = cv2.findContours(blobs, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    page_h, page_w = gray.shape[:2]
+    regions = []
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        if w < 8 or h < 8 or h > max_height:
+            continue  # specks and pictures
+        x0, y0 = max(0, x - padding), max(0, y - padding)
+        x1, y1 = min(page_w, x + w + padding), min(page_h, y + h + padding)
+        regions.append([x0, y0, x1, y1])
+
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in regions:
+            for other in result:
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    other[:] = [min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])]
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        regions = result
+
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in regions]
+
+
+def _assign_lines(page):
+    """
+    Group a page's words into lines the way Tesseract would: a word joins a line when
+    its vertical centre lies within the line's height. Lines are seeded by the tallest
+    words so punctuation and dots don't start lines of their own.
+    """
+    order = sorted(range(len(page["text"])), key=lambda i: page["height"][i], reverse=True)
+    lines = []  # (top, bottom)
+
+    for i in order:
+        centre = page["top"][i] + page["height"][i] / 2
+        for number, (top, bottom) in enumerate(lines, start=1):
+            if top <= centre <= bottom:
+                page["line_num"][i] = number
+                break
+        else:
+            lines.append((page["top"][i], page["top"][i] + page["height"][i]))
+            page["line_num"][i] = len(lines)
+
+
+def pack(sizes, max_width=2400, max_height=6000, gutter=32):
+    """
+    Shelf-pack rectangles into as few mosaics as possible, tallest first.
+
+    :param sizes: [(w, h), ...]
+    :return: (placements, mosaic_sizes); placements[i] = (mosaic index, x, y) for sizes[i]
+    """
+    width = max([max_width] + [w + 2 * gutter for w, _ in sizes])
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True)
+
+    placements = [None] * len(sizes)
+    mosaic_sizes = []
+    mosaic = -1
+    x = y = shelf_h = 0
+
+    for i in order:
+        w, h = sizes[i]
+        if mosaic < 0 or x + w + gutter > width:
+            # New shelf
+            y += shelf_h + gutter if mosaic >= 0 else 0
+            x, shelf_h = gutter, 0
+            if mosaic < 0 or y + h + gutter > max_height:
+                if mosaic >= 0:
+                    mosaic_sizes[mosaic] = (width, mosaic_sizes[mosaic][1])
+                mosaic += 1
+                mosaic_sizes.append((width, 0))
+                y = gutter
+
+        placements[i] = (mosaic, x, y)
+        x += w + gutter
+        shelf_h = max(shelf_h, h)
+        mosaic_sizes[mosaic] = (width, max(mosaic_sizes[mosaic][1], y + h + gutter))
+
+    return placements, mosaic_sizes
+
+
+def ocr_pages(images, tesseract_config="", scale=1.0):
+    """
+    OCR several page images with a handful of Tesseract calls.
+
+    :param images: Page images (grayscale or BGR ndarrays)
+    :param scale: Render DPI / 300; region detection lengths are tuned for 300 DPI
+    :return: One image_to_data-style dict per page, coordinates in that page's pixels
+    """
+    results = [{key: [] for key in OCR_KEYS} for _ in images]
+
+    crops = []  # (page index, region box, crop)
+    for page_index, img in enumerate(images):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        regions = find_text_regions(
+            gray,
+            padding=max(1, round(8 * scale)),
+            join_gap=max(1, round(28 * scale)),
+            line_kernel=max(1, round(40 * scale)),
+            max_height=round(300 * scale)
+        )
+        for x, y, w, h in regions:
+            crops.append((page_index, (x, y, w, h), gray[y:y + h, x:x + w]))
+
+    if not crops:
+        return results
+
+    placements, mosaic_sizes = pack([(c[1][2], c[1][3]) for c in crops])
+
+    for mosaic_index, (mw, mh) in enumerate(mosaic_sizes):
+        canvas = np.full((mh, mw), 255, dtype=np.uint8)
+        placed = []
+        for crop, (m, px, py) in zip(crops, placements):
+            if m != mosaic_index:
+                continue
+            _, (_, _, w, h), pixels = crop
+            canvas[py:py + h, px:px + w] = pixels
+            placed.append((px, py, crop))
+
+        data = pytesseract.image_to_data(canvas, config=tesseract_config, output_type=Output.DICT)
+
+        for i in range(len(data["text"])):
+            if int(data["conf"][i]) == -1 or not data["text"][i].strip():
+                continue
+
+            cx = data["left"][i] + data["width"][i] / 2
+            cy = data["top"][i] + data["height"][i] / 2
+            for px, py, (page_index, (rx, ry, w, h), _) in placed:
+                if px <= cx < px + w and py <= cy < py + h:
+                    break
+            else:
+                continue  # word in a gutter; shouldn't happen
+
+            page = results[page_index]
+            page["text"].append(data["text"][i])
+            page["conf"].append(data["conf"][i])
+            page["left"].append(data["left"][i] - px + rx)
+            page["top"].append(data["top"][i] - py + ry)
+            page["width"].append(data["width"][i])
+            page["height"].append(data["height"][i])
+            page["block_num"].append(1)
+            page["par_num"].append(1)
+            page["line_num"].append(0)
+
+    for page in results:
+        _assign_lines(page)
+
+    return results
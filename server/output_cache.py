@@ -0,0 +1,154 @@
+"""
+On-disk cache of generated forms.
+
+Processing the same template with the same profile and settings produces the same
+bytes, so the result is stored under a key derived from exactly those inputs. The
+key doubles as the response ETag: a client that already holds it gets a 304, and a
+client that doesn't gets the stored file through send_file (sendfile under gunicorn)
+instead of a pipeline run.
+
+The folder is shared by all workers. It is bounded by total size; the least recently
+used files (by mtime, refreshed on every hit) are removed first. The files hold personal
+data, so the upload GC also removes those unused for longer than the upload retention.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from cache import LRUCache
+
+# Bump when a pipeline change alters the output for the same inputs
+CACHE_VERSION = 1
+
+_digests = LRUCache(4096)
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, remembered per (path, size, mtime)."""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digests.put(memo_key, digest)
+    return digest
+
+
+def output_key(template_digest, profile, settings):
+    """
+    Cache key / ETag for one rendering.
+
+    :param template_digest: Content hash of the uploaded form
+    :param profile: The user's profile dict
+    :param settings: JSON-serialisable dict of everything else that changes the output
+    """
+    payload = json.dumps(
+        [CACHE_VERSION, template_digest, profile, settings],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:40]
+
+
+class OutputCache:
+    """
+    Directory of generated outputs, one file per key, bounded by `max_bytes`.
+    A max_bytes of 0 disables the cache.
+    """
+
+    def __init__(self, folder, max_bytes=256 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        """
+        The stored output for `key` as an open binary file, or None. The file stays
+        readable even if another worker evicts it meanwhile; the caller closes it.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted since; the open file is still complete
+        return f
+
+    def put(self, key, data):
+        """Store `data` (bytes) under `key` and evict old entries if over budget."""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+
+        # Write to a private name first so readers never see a partial file
+        tmp_path = self._path(f".{key}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        self._evict()
+
+    def expire(self, max_age):
+        """Remove outputs not used for max_age seconds. Returns the number removed."""
+        if not self.enabled:
+            return 0
+
+        cutoff = time.time() - max_age
+        removed = 0
+        with self._lock:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    try:
+                        # Temporary files of interrupted writes go too
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # evicted by another worker
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,439 @@
+"""
+Read what born-digital PDFs already contain instead of recovering it from pixels.
+
+Coordinates are scaled from PDF points (1/72 inch, top-left origin as reported
+by Poppler) into the pixel space of a page rendered at `dpi`, so the results
+line up with what convert_from_path + Tesseract would produce.
+"""
+import os
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+
+
+def _poppler_tool(name, poppler_path=None):
+    """Locate a Poppler command line tool, honouring POPPLER_PATH like pdf2image does."""
+    if poppler_path:
+        found = shutil.which(name, path=poppler_path)
+        if found:
+            return found
+        return os.path.join(poppler_path, name)
+    return name
+
+
+def _local_name(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def extract_words(pdf_path, dpi=300, poppler_path=None, timeout=30):
+    """
+    Extract words and their boxes from the PDF text layer with `pdftotext -bbox-layout`.
+
+    Each page comes back as a dict shaped like pytesseract's image_to_data(output_type=DICT)
+    (text, conf, left, top, width, height, block_num, par_num, line_num) so it can go straight
+    into Tokenizer._process_ocr_data. Poppler's flow/block/line structure stands in for
+    Tesseract's block/paragraph/line.
+
+    :param pdf_path: Path to the PDF
+    :param dpi: Resolution of the pixel space to scale into
+    :param poppler_path: Directory containing the Poppler binaries (optional)
+    :return: List of {"width", "height", "data"} per page (width/height in pixels),
+             or None if the text layer could not be read
+    """
+    try:
+        result = subprocess.run(
+            [_poppler_tool("pdftotext", poppler_path), "-bbox-layout", "-enc", "UTF-8", pdf_path, "-"],
+            capture_output=True,
+            timeout=timeout
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Warning: could not read PDF text layer: {e}")
+        return None
+
+    if result.returncode != 0:
+        print(f"Warning: pdftotext failed: {result.stderr.decode(errors='replace').strip()}")
+        return None
+
+    try:
+        root = ET.fromstring(result.stdout)
+    except ET.ParseError as e:
+        print(f"Warning: could not parse pdftotext output: {e}")
+        return None
+
+    scale = dpi / 72
+    pages = []
+
+    for page in root.iter():
+        if _local_name(page) != "page":
+            continue
+
+        data = {key: [] for key in ("text", "conf", "left", "top", "width", "height", "block_num", "par_num", "line_num")}
+
+        flows = [el for el in page if _local_name(el) == "flow"]
+        for flow_num, flow in enumerate(flows, start=1):
+            blocks = [el for el in flow if _local_name(el) == "block"]
+            for par_num, block in enumerate(blocks, start=1):
+                lines = [el for el in block if _local_name(el) == "line"]
+                for line_num, line in enumerate(lines, start=1):
+                    for word in line:
+                        if _local_name(word) != "word" or not (word.text or "").strip():
+                            continue
+
+                        x_min = float(word.get("xMin")) * scale
+                        y_min = float(word.get("yMin")) * scale
+                        x_max = float(word.get("xMax")) * scale
+                        y_max = float(word.get("yMax")) * scale
+
+                        data["text"].append(word.text)
+                        data["conf"].append(100)
+                        data["left"].append(round(x_min))
+                        data["top"].append(round(y_min))
+                        data["width"].append(round(x_max - x_min))
+                        data["height"].append(round(y_max - y_min))
+                        data["block_num"].append(flow_num)
+                        data["par_num"].append(par_num)
+                        data["line_num"].append(line_num)
+
+        pages.append({
+            "width": round(float(page.get("width")) * scale),
+            "height": round(float(page.get("height")) * scale),
+            "data": data,
+        })
+
+    return pages
+
+
+# ---------------------------------------------------------------------------
+# Vector FIELD_SPACE detection
+# ---------------------------------------------------------------------------
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def _concat(m1, m2):
+    """Matrix product m1 x m2 in PDF's row-vector convention (apply m1 first)."""
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2,
+        a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2,
+        c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2,
+        e1 * b2 + f1 * d2 + f2,
+    )
+
+
+def _apply(m, x, y):
+    a, b, c, d, e, f = m
+    return a * x + c * y + e, b * x + d * y + f
+
+
+def _luminance(operands):
+    """
+    Approximate 0-255 gray level of a colour operator's operands, using the same weights
+    as cv2.COLOR_BGR2GRAY. Anything that isn't plain gray/RGB/CMYK counts as black.
+    """
+    try:
+        values = [float(v) for v in operands]
+    except (TypeError, ValueError):
+        return 0
+    if len(values) == 1:
+        return values[0] * 255
+    if len(values) == 3:
+        r, g, b = values
+        return (0.299 * r + 0.587 * g + 0.114 * b) * 255
+    if len(values) == 4:
+        c, m, y, k = values
+        r, g, b = ((1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k))
+        return (0.299 * r + 0.587 * g + 0.114 * b) * 255
+    return 0
+
+
+class _VectorPage:
+    """
+    Walks one page's content stream and collects the axis-aligned strokes and fills
+    that the OpenCV pass would pick up: dark enough to survive the threshold at 200
+    and at least `min_length` pixels long (the morphological kernel size).
+    """
+
+    def __init__(self, reader, page, scale, min_length, threshold):
+        self.reader = reader
+        self.scale = scale
+        self.min_length = min_length
+        self.threshold = threshold
+
+        left, bottom, right, top = (float(v) for v in page.mediabox)
+        self.left, self.top = left, top
+        self.page_area = (right - left) * (top - bottom)
+        self.width = round((right - left) * scale)
+        self.height = round((top - bottom) * scale)
+
+        self.boxes = []          # (x0, y0, x1, y1) in pixels
+        self.image_area = 0.0    # largest image footprint, in square points
+
+    def _to_pixels(self, x, y):
+        return (x - self.left) * self.scale, (self.top - y) * self.scale
+
+    def run(self, contents, resources, ctm=IDENTITY, depth=0):
+        state = {"ctm": ctm, "lw": 1.0, "stroke": 0, "fill": 0}
+        stack = []
+        subpaths = []
+        current = None
+
+        for operands, operator in contents.operations:
+            op = operator.decode("latin-1") if isinstance(operator, bytes) else operator
+
+            if op == "q":
+                stack.append(dict(state))
+            elif op == "Q":
+                if stack:
+                    state = stack.pop()
+            elif op == "cm":
+                state["ctm"] = _concat(tuple(float(v) for v in operands), state["ctm"])
+            elif op == "w":
+                state["lw"] = float(operands[0])
+
+            # Colours
+            elif op in ("g", "rg", "k", "sc", "scn"):
+                state["fill"] = _luminance(operands)
+            elif op in ("G", "RG", "K", "SC", "SCN"):
+                state["stroke"] = _luminance(operands)
+            elif op == "cs":
+                state["fill"] = 0
+            elif op == "CS":
+                state["stroke"] = 0
+
+            # Path construction, kept in device space (points)
+            elif op == "m":
+                current = {"points": [_apply(state["ctm"], float(operands[0]), float(operands[1]))], "closed": False}
+                subpaths.append(current)
+            elif op in ("l", "c", "v", "y"):
+                if current is None:
+                    continue
+                x, y = float(operands[-2]), float(operands[-1])
+                current["points"].append(_apply(state["ctm"], x, y))
+            elif op == "h":
+                if current is not None:
+                    current["closed"] = True
+            elif op == "re":
+                x, y, w, h = (float(v) for v in operands)
+                corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+                current = {"points": [_apply(state["ctm"], *p) for p in corners], "closed": True}
+                subpaths.append(current)
+
+            # Path painting
+            elif op in ("S", "s", "f", "F", "f*", "B", "B*", "b", "b*", "n"):
+                if op in ("s", "b", "b*") and current is not None:
+                    current["closed"] = True
+                if op in ("f", "F", "f*", "B", "B*", "b", "b*") and state["fill"] < self.threshold:
+                    self._add_fills(subpaths)
+                if op in ("S", "s", "B", "B*", "b", "b*") and state["stroke"] < self.threshold:
+                    self._add_strokes(subpaths, state)
+                subpaths, current = [], None
+
+            # Images and nested forms
+            elif op == "Do" and depth < 8:
+                self._do_xobject(operands[0], resources, state["ctm"], depth)
+            elif op == "INLINE IMAGE":
+                self._add_image(state["ctm"])
+
+    def _do_xobject(self, name, resources, ctm, depth):
+        xobjects = resources.get("/XObject") if resources else None
+        if not xobjects:
+            return
+        xobjects = xobjects.get_object()
+        if name not in xobjects:
+            return
+
+        xobject = xobjects[name].get_object()
+        subtype = xobject.get("/Subtype")
+
+        if subtype == "/Image":
+            self._add_image(ctm)
+        elif subtype == "/Form":
+            from pypdf.generic import ContentStream
+
+            matrix = tuple(float(v) for v in xobject.get("/Matrix", IDENTITY))
+            form_resources = xobject.get("/Resources")
+            form_resources = form_resources.get_object() if form_resources else resources
+            self.run(ContentStream(xobject, self.reader), form_resources, _concat(matrix, ctm), depth + 1)
+
+    def run_annotations(self, page, depth=0):
+        """
+        Walk the normal appearance streams of the page's annotations, which Poppler draws on
+        top of the content stream. Every fillable AcroForm field is a widget annotation.
+
+        :return: False if a widget has no appearance stream to read (Poppler synthesises one),
+                 so the caller should rasterize the page instead
+        """
+        from pypdf.generic import ContentStream
+
+        annots = page.get("/Annots")
+        if not annots:
+            return True
+
+        for annot in annots.get_object():
+            annot = annot.get_object()
+            flags = int(annot.get("/F", 0))
+            if flags & 0b10 or flags & 0b100000:
+                continue  # Hidden / NoView
+
+            appearance = annot.get("/AP")
+            normal = appearance.get_object().get("/N") if appearance else None
+            if normal is not None:
+                normal = normal.get_object()
+                if "/BBox" not in normal:
+                    # Dictionary of states (checkboxes, radio buttons): draw the current one
+                    state = annot.get("/AS")
+                    normal = normal.get(state).get_object() if state and state in normal else None
+
+            if normal is None:
+                if annot.get("/Subtype") == "/Widget":
+                    return False
+                continue
+
+            rect = [float(v) for v in annot["/Rect"]]
+            ctm = self._appearance_matrix(normal, rect)
+            if ctm is None:
+                continue
+
+            resources = normal.get("/Resources")
+            self.run(ContentStream(normal, self.reader), resources.get_object() if resources else None,
+                     ctm, depth + 1)
+
+        return True
+
+    def _appearance_matrix(self, stream, rect):
+        """
+        Map an appearance stream into page space (PDF 32000, 12.5.5): its /Matrix is applied
+        to /BBox, and the result is scaled and moved onto the annotation's /Rect.
+        """
+        matrix = tuple(float(v) for v in stream.get("/Matrix", IDENTITY))
+        x0, y0, x1, y1 = (float(v) for v in stream["/BBox"])
+        corners = [_apply(matrix, x, y) for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+        bx0, by0 = min(c[0] for c in corners), min(c[1] for c in corners)
+        bx1, by1 = max(c[0] for c in corners), max(c[1] for c in corners)
+        if bx1 - bx0 <= 0 or by1 - by0 <= 0:
+            return None
+
+        rx0, ry0 = min(rect[0], rect[2]), min(rect[1], rect[3])
+        rx1, ry1 = max(rect[0], rect[2]), max(rect[1], rect[3])
+        sx, sy = (rx1 - rx0) / (bx1 - bx0), (ry1 - ry0) / (by1 - by0)
+        fit = (sx, 0.0, 0.0, sy, rx0 - bx0 * sx, ry0 - by0 * sy)
+        return _concat(matrix, fit)
+
+    def _add_image(self, ctm):
+        # Images are drawn into the unit square, so the CTM's determinant is their area
+        a, b, c, d, _, _ = ctm
+        self.image_area = max(self.image_area, abs(a * d - b * c))
+
+    def _add_fills(self, subpaths):
+        for path in subpaths:
+            pixels = [self._to_pixels(*p) for p in path["points"]]
+            xs = [p[0] for p in pixels]
+            ys = [p[1] for p in pixels]
+            x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+            if x1 - x0 >= self.min_length or y1 - y0 >= self.min_length:
+                self.boxes.append((x0, y0, x1, y1))
+
+    def _add_strokes(self, subpaths, state):
+        a, b, c, d, _, _ = state["ctm"]
+        half = max(0.5, state["lw"] * abs(a * d - b * c) ** 0.5 * self.scale / 2)
+
+        for path in subpaths:
+            pixels = [self._to_pixels(*p) for p in path["points"]]
+            if path["closed"] and len(pixels) > 2:
+                pixels.append(pixels[0])
+
+            for (x0, y0), (x1, y1) in zip(pixels, pixels[1:]):
+                dx, dy = abs(x1 - x0), abs(y1 - y0)
+                # Only (near) horizontal or vertical runs survive the line kernels
+                if (dx >= self.min_length and dy <= half) or (dy >= self.min_length and dx <= half):
+                    self.boxes.append((min(x0, x1) - half, min(y0, y1) - half, max(x0, x1) + half, max(y0, y1) + half))
+
+
+def _merge_boxes(boxes, tolerance=1.0):
+    """Union boxes that touch or overlap, like connected line pixels forming one contour."""
+    merged = [list(b) for b in boxes]
+    changed = True
+
+    while changed:
+        changed = False
+        result = []
+        for box in merged:
+            for other in result:
+                if (box[0] <= other[2] + tolerance and other[0] <= box[2] + tolerance and
+                        box[1] <= other[3] + tolerance and other[1] <= box[3] + tolerance):
+                    other[0], other[1] = min(other[0], box[0]), min(other[1], box[1])
+                    other[2], other[3] = max(other[2], box[2]), max(other[3], box[3])
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+
+    return merged
+
+
+def extract_field_spaces(pdf_path, dpi=300, min_length=40, threshold=200, raster_fraction=0.5):
+    """
+    Find FIELD_SPACE candidates (underlines and boxes) from the PDF's drawing operators.
+
+    Mirrors Tokenizer._get_visual_token: strokes/fills lighter than `threshold` are ignored,
+    annotation appearance streams (AcroForm widgets) are drawn like Poppler draws them,
+    only horizontal/vertical runs of at least `min_length` pixels count, touching runs are
+    merged into one box and boxes must satisfy w > 100 and h > 5. Like there, pixel lengths
+    are given at 300 DPI and scaled to `dpi`.
+
+    :param pdf_path: Path to the PDF
+    :param dpi: Resolution of the pixel space to scale into
+    :param raster_fraction: Pages where a single image covers more than this fraction are
+                            treated as scans: "boxes" is None and "scanned" is True
+    :return: List per page of {"width", "height", "boxes": [(x, y, w, h), ...], "scanned"}, with
+             None for pages that need the raster path for other reasons (rotated pages, widgets
+             without appearance streams); None if the PDF could not be read at all
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+
+    pixel_scale = dpi / 300
+
+    try:
+        reader = PdfReader(pdf_path)
+        pages = []
+
+        for page in reader.pages:
+            if page.rotation % 360:
+                pages.append(None)
+                continue
+
+            walker = _VectorPage(reader, page, dpi / 72, min_length * pixel_scale, threshold)
+            contents = page.get_contents()
+            if contents is not None:
+                resources = page.get("/Resources")
+                walker.run(contents, resources.get_object() if resources else None)
+
+            if walker.image_area > raster_fraction * walker.page_area:
+                pages.append({"width": walker.width, "height": walker.height, "boxes": None, "scanned": True})
+                continue
+
+            if not walker.run_annotations(page):
+                pages.append(None)
+                continue
+
+            boxes = []
+            for x0, y0, x1, y1 in _merge_boxes(walker.boxes):
+                x, y = int(x0), int(y0)
+                w, h = int(x1 + 0.999) - x, int(y1 + 0.999) - y
+                if w > 100 * pixel_scale and h > 5 * pixel_scale:
+                    boxes.append((x, y, w, h))
+
+            pages.append({"width": walker.width, "height": walker.height, "boxes": boxes, "scanned": False})
+
+        return pages
+    except Exception as e:
+        print(f"Warning: could not read PDF drawing operators: {e}")
+        return None
@@ -0,0 +1,156 @@
+"""
+Size checks that run before anything is rasterized.
+
+The page count and media boxes of a PDF (or the header of an image) say how many
+pixels the pipeline is about to allocate. Documents over budget are rejected with
+a 413 before Poppler runs. A PDF whose pages are merely too large for 300 DPI
+(posters, engineering drawings) is planned at a lower DPI instead, as long as that
+stays at or above MIN_DPI.
+
+    plan = preflight.check(path)   # raises PreflightError
+    Tokenizer(path, dpi=plan.dpi)
+"""
+import math
+import os
+
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "25"))
+MAX_PAGES = int(os.getenv("MAX_PAGES", "50"))
+# A2 at 300 DPI is ~35 MP; bigger pages are rendered at a lower DPI
+MAX_PAGE_MEGAPIXELS = float(os.getenv("MAX_PAGE_MEGAPIXELS", "35"))
+# ~50 letter pages at 300 DPI
+MAX_DOCUMENT_MEGAPIXELS = float(os.getenv("MAX_DOCUMENT_MEGAPIXELS", "420"))
+MAX_IMAGE_MEGAPIXELS = float(os.getenv("MAX_IMAGE_MEGAPIXELS", "50"))
+MIN_DPI = int(os.getenv("MIN_DPI", "100"))
+
+RENDER_DPI = 300
+
+CHUNK_SIZE = 1 << 16
+
+
+class PreflightError(ValueError):
+    """A document that must not enter the pipeline. `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class Plan:
+    """How a document will be processed: pages, render DPI and megapixels at that DPI."""
+
+    def __init__(self, pages, dpi, megapixels):
+        self.pages = pages
+        self.dpi = dpi
+        self.megapixels = megapixels
+
+    def __repr__(self):
+        return f"Plan(pages={self.pages}, dpi={self.dpi}, megapixels={self.megapixels:.1f})"
+
+
+def save_stream(stream, path, max_bytes=None, digest=None):
+    """
+    Copy an upload stream to `path` in chunks, giving up as soon as it exceeds `max_bytes`.
+
+    :param digest: Optional hashlib object fed with every chunk on the way
+    :return: Number of bytes written
+    """
+    if max_bytes is None:
+        max_bytes = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PreflightError(f"File is larger than {MAX_UPLOAD_MB:g} MB")
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return size
+
+
+def page_sizes(pdf_path):
+    """(width, height) of every page in inches, from the media boxes. No rendering."""
+    from pypdf import PdfReader
+
+    sizes = []
+    for page in PdfReader(pdf_path).pages:
+        box = page.mediabox
+        sizes.append((float(box.width) / 72, float(box.height) / 72))
+    return sizes
+
+
+def check(path, dpi=RENDER_DPI):
+    """
+    Plan a document against the budgets.
+
+    :param dpi: The DPI the pipeline would like to render at
+    :return: Plan
+    :raises PreflightError: The document is unreadable or over budget
+    """
+    ext = path.lower().rsplit(".", 1)[-1]
+    if ext == "pdf":
+        return _check_pdf(path, dpi)
+    return _check_image(path)
+
+
+def _check_pdf(path, dpi):
+    try:
+        sizes = page_sizes(path)
+    except ImportError:
+        # Without pypdf there is nothing to check against; Poppler still enforces sanity
+        return Plan(pages=1, dpi=dpi, megapixels=8.5 * 11 * dpi * dpi / 1e6)
+    except Exception as e:
+        # The parser's message may name server paths; it goes to the log, not the client
+        print(f"Warning: preflight could not read {path}: {e}")
+        raise PreflightError("Could not read the PDF", status=400)
+
+    if not sizes:
+        raise PreflightError("The PDF has no pages", status=400)
+    if len(sizes) > MAX_PAGES:
+        raise PreflightError(f"The PDF has {len(sizes)} pages; at most {MAX_PAGES} are supported")
+
+    # Areas in square inches; at `dpi` a page is area * dpi^2 / 1e6 megapixels
+    largest = max(w * h for w, h in sizes)
+    total = sum(w * h for w, h in sizes)
+
+    # Highest DPI (up to the requested one) that keeps the largest page and the whole document in budget
+    fit = min(
+        math.sqrt(MAX_PAGE_MEGAPIXELS * 1e6 / largest) if largest else dpi,
+        math.sqrt(MAX_DOCUMENT_MEGAPIXELS * 1e6 / total) if total else dpi
+    )
+    planned = min(dpi, int(fit))
+
+    if planned < MIN_DPI:
+        raise PreflightError(
+            f"The PDF is too large to process (it would need {total * MIN_DPI * MIN_DPI / 1e6:.0f} "
+            f"megapixels at {MIN_DPI} DPI)"
+        )
+
+    return Plan(pages=len(sizes), dpi=planned, megapixels=total * planned * planned / 1e6)
+
+
+def _check_image(path):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:  # parses the header only
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise PreflightError("The image is too large to process")
+    except Exception as e:
+        print(f"Warning: preflight could not read {path}: {e}")
+        raise PreflightError("Could not read the image", status=400)
+
+    megapixels = width * height / 1e6
+    if megapixels > MAX_IMAGE_MEGAPIXELS:
+        raise PreflightError(
+            f"The image is {megapixels:.0f} megapixels; at most {MAX_IMAGE_MEGAPIXELS:g} are supported"
+        )
+
+    return Plan(pages=1, dpi=RENDER_DPI, megapixels=megapixels)
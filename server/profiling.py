@@ -0,0 +1,90 @@
+"""
+Opt-in profiling of individual /process jobs.
+
+With PROFILING_ENABLED=1, a request carrying the header `X-Profile: <PROFILE_TOKEN>`
+(or `X-Profile: 1` when no token is configured) runs the pipeline under cProfile.
+The profile is written to PROFILE_FOLDER/<job id>/profile.prof together with a
+job.json holding the page/token counts and timings. Open it with
+`python -m pstats profile.prof` or snakeviz.
+
+cProfile hooks every thread of the interpreter on 3.12+, so app.py admits a profiled
+job exclusively (JobScheduler.acquire(..., exclusive=True)): no other /process job of
+the worker runs alongside it. Lighter requests (/upload, /submit) on other threads can
+still show up in the profile.
+
+When profiling is off this costs one header lookup per request.
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_FOLDER = os.getenv("PROFILE_FOLDER", os.path.join(BASE_DIR, "profiles"))
+
+# Only one job is profiled at a time (the profiler is interpreter-wide on 3.12+)
+_profiler_lock = threading.Lock()
+
+
+def requested(headers):
+    """True if profiling is enabled and this request asked for it."""
+    if not PROFILING_ENABLED:
+        return False
+    value = headers.get("X-Profile")
+    if not value:
+        return False
+    return value == PROFILE_TOKEN if PROFILE_TOKEN else value == "1"
+
+
+class JobProfile:
+    """
+    Context manager that profiles the enclosed block and stores the result.
+    `job` is a dict the pipeline fills with whatever it wants recorded (pages, tokens...).
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.job_id = uuid.uuid4().hex
+        self.folder = os.path.join(PROFILE_FOLDER, self.job_id)
+        self.profiler = None
+        self.started = None
+
+    def __enter__(self):
+        if _profiler_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.started = time.perf_counter()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler is None:
+            # Another job holds the profiler; this one ran unprofiled
+            return False
+
+        self.profiler.disable()
+        elapsed = time.perf_counter() - self.started
+        _profiler_lock.release()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(self.folder, "profile.prof"))
+
+        meta = {
+            "job_id": self.job_id,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "error": repr(exc) if exc else None,
+            **self.job,
+        }
+        with open(os.path.join(self.folder, "job.json"), "w") as f:
+            json.dump(meta, f, indent=2, default=str)
+
+        return False
+
+    @property
+    def captured(self):
+        return self.profiler is not None
@@ -0,0 +1,160 @@
+"""
+Readiness checks for /readyz.
+
+A synthetic one-field form is pushed through Tokenizer -> Parser -> Generator
+once per worker. That loads Tesseract's language data, starts Poppler and
+resolves the Generator font before real traffic arrives, and records how long
+each dependency took. The warm-up uses the same Tokenizer/Generator settings as
+/process, so it warms the code path production actually runs.
+
+A failed warm-up (a Tesseract or Poppler hiccup) is retried with exponential
+backoff, so one transient error doesn't keep the worker out of rotation for good.
+"""
+import io
+import os
+import tempfile
+import threading
+import time
+
+RETRY_DELAY = float(os.getenv("READINESS_RETRY_DELAY", "5"))
+MAX_RETRY_DELAY = float(os.getenv("READINESS_MAX_RETRY_DELAY", "300"))
+
+_lock = threading.Lock()
+_state = {
+    "status": "pending",   # pending -> warming -> ready | failed (-> warming again after a delay)
+    "checks": {},
+    "error": None,
+    "attempts": 0,
+    "retry_in": None,
+}
+
+
+def start(load_pipeline, poppler_path=None, tokenizer_options=None, make_generator=None):
+    """
+    Run the warm-up in a background thread unless it already ran (or is running).
+
+    :param load_pipeline: Callable returning the (Tokenizer, Parser, Generator) classes
+    :param poppler_path: Passed through to Tokenizer/Generator
+    :param tokenizer_options: Extra Tokenizer keyword arguments, as /process uses them
+    :param make_generator: Callable returning the Generator /process uses
+    """
+    with _lock:
+        if _state["status"] != "pending":
+            return
+        _state["status"] = "warming"
+
+    thread = threading.Thread(
+        target=_run_with_retries,
+        args=(load_pipeline, poppler_path, tokenizer_options or {}, make_generator),
+        name="readiness-warmup",
+        daemon=True
+    )
+    thread.start()
+
+
+def status():
+    """Return (ready, report) where report is JSON-serialisable."""
+    with _lock:
+        report = {
+            "status": _state["status"],
+            "checks": dict(_state["checks"]),
+        }
+        if _state["error"]:
+            report["error"] = _state["error"]
+            report["attempts"] = _state["attempts"]
+            report["retry_in"] = _state["retry_in"]
+        return _state["status"] == "ready", report
+
+
+def _record(name, started, **details):
+    with _lock:
+        _state["checks"][name] = {"ms": round((time.perf_counter() - started) * 1000, 1), **details}
+
+
+def _run_with_retries(load_pipeline, poppler_path, tokenizer_options, make_generator):
+    delay = RETRY_DELAY
+    while True:
+        with _lock:
+            _state["attempts"] += 1
+            _state["retry_in"] = None
+        if _run(load_pipeline, poppler_path, tokenizer_options, make_generator):
+            return
+
+        with _lock:
+            _state["retry_in"] = delay
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RETRY_DELAY)
+        with _lock:
+            _state["status"] = "warming"
+
+
+def _run(load_pipeline, poppler_path, tokenizer_options, make_generator):
+    """One warm-up attempt. Returns True on success."""
+    try:
+        started = time.perf_counter()
+        Tokenizer, Parser, Generator = load_pipeline()
+        _record("imports", started)
+
+        import pytesseract
+        from pdf2image import pdfinfo_from_path
+
+        started = time.perf_counter()
+        version = pytesseract.get_tesseract_version()
+        _record("tesseract", started, version=str(version))
+
+        gen = make_generator() if make_generator else Generator(poppler_path=poppler_path)
+        started = time.perf_counter()
+        font = gen.load_font()
+        _record("font", started, font=getattr(font, "path", "default"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "warmup_form.pdf")
+            _synthetic_form().save(path, "PDF", resolution=300.0)
+
+            started = time.perf_counter()
+            pdfinfo_from_path(path, poppler_path=poppler_path)
+            _record("poppler", started)
+
+            started = time.perf_counter()
+            tokens, _ = Tokenizer(path, poppler_path=poppler_path, **tokenizer_options).tokenize_file()
+            _record("tokenize", started, tokens=len(tokens))
+
+            started = time.perf_counter()
+            parser = Parser()
+            accepted, _ = parser(tokens)
+            _record("parse", started, accepted=accepted, fields=len(parser.mappings))
+
+            started = time.perf_counter()
+            gen.generate(path, parser.mappings, {"Full Name": "Juan Dela Cruz"}, io.BytesIO())
+            _record("generate", started)
+
+        with _lock:
+            _state["status"] = "ready"
+            _state["error"] = None
+        return True
+    except Exception as e:
+        with _lock:
+            _state["status"] = "failed"
+            _state["error"] = f"{type(e).__name__}: {e}"
+        return False
+
+
+def _synthetic_form():
+    """A small 300 DPI page with a title, one labelled field box and a note."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.new("RGB", (1700, 700), "white")
+    draw = ImageDraw.Draw(img)
+
+    try:
+        title_font = ImageFont.load_default(size=64)
+        body_font = ImageFont.load_default(size=40)
+    except TypeError:
+        # Pillow without FreeType can't size the default font
+        title_font = body_font = ImageFont.load_default()
+
+    draw.text((100, 80), "Warm Up Form", fill="black", font=title_font)
+    draw.text((100, 330), "Full Name:", fill="black", font=body_font)
+    draw.rectangle((450, 310, 1500, 390), outline="black", width=4)
+    draw.text((100, 520), "Please write clearly", fill="black", font=body_font)
+    return img
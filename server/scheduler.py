@@ -0,0 +1,110 @@
+"""
+Admission control for /process: shortest job first, with aging.
+
+A job's cost is estimated before anything is rendered (see preflight.check): the
+number of megapixels the pipeline will rasterize, from the page count and page
+sizes in the PDF metadata or the image header. Waiting jobs are admitted cheapest first,
+so a one-page contact form doesn't queue behind a 40-page packet. Every second a
+job waits lowers its cost by `aging_rate` megapixels, so big jobs still get their
+turn once they have waited long enough.
+
+Because all waiting jobs age at the same rate, the order never changes after a job
+is queued: priority = cost + aging_rate * arrival time, kept in a heap.
+
+A job at the front of the queue is next for a slot and is not timed out. With
+aging_rate * timeout >= the largest cost (app.py checks this), a job that has waited
+out its timeout is ahead of anything arriving later, so it keeps the front until admitted.
+
+An exclusive job (a profiled one) takes every slot, so it runs alone in the process.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+# Letter page at 300 DPI, the default aging rate (one page per second of waiting)
+DEFAULT_PAGE_MEGAPIXELS = 8.5 * 11 * 300 * 300 / 1e6
+
+
+class JobScheduler:
+    """
+    Counting semaphore that admits the cheapest waiting job first.
+
+        if scheduler.acquire(cost, timeout=30):
+            try:
+                ...
+            finally:
+                scheduler.release()
+    """
+
+    def __init__(self, max_jobs, aging_rate=DEFAULT_PAGE_MEGAPIXELS):
+        self.max_jobs = max_jobs
+        self.aging_rate = aging_rate
+        self._running = 0
+        self._exclusive = False
+        self._waiting = []  # heap of [priority, sequence, admitted, slots]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, cost, timeout=None, exclusive=False):
+        """
+        Wait for a slot. Returns False if none was granted within `timeout` seconds,
+        unless the job is at the front of the queue by then.
+
+        :param exclusive: Wait for (and hold) all slots, so no other job runs meanwhile
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        slots = self.max_jobs if exclusive else 1
+        entry = [cost + self.aging_rate * time.monotonic(), next(self._sequence), False, slots]
+
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            self._admit()
+
+            while not entry[2]:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0 and self._waiting[0] is entry:
+                    # Next in line: wait for the slot (every admission wakes the waiters)
+                    remaining = None
+                elif remaining is not None and remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    # An exclusive job at the front may have been holding the others back
+                    self._admit()
+                    return False
+                self._condition.wait(remaining)
+
+            return True
+
+    def release(self):
+        with self._condition:
+            if self._exclusive:
+                # Nothing else runs beside an exclusive job, so this release is its own
+                self._running = 0
+                self._exclusive = False
+            else:
+                self._running -= 1
+            self._admit()
+
+    def _admit(self):
+        """Hand free slots to the front of the queue (caller holds the condition)."""
+        admitted = False
+        # The front job waits for as many slots as it needs; the ones behind it wait too
+        while self._waiting and self._running + self._waiting[0][3] <= self.max_jobs:
+            entry = heapq.heappop(self._waiting)
+            entry[2] = True
+            self._running += entry[3]
+            self._exclusive = entry[3] > 1
+            admitted = True
+        if admitted:
+            self._condition.notify_all()
+
+    @property
+    def queued(self):
+        with self._condition:
+            return len(self._waiting)
+
+    @property
+    def running(self):
+        with self._condition:
+            return self._running
@@ -0,0 +1,271 @@
+"""
+Golden-output snapshots of the pipeline, to prove a faster pipeline is still a correct one.
+
+For every form in ../forms this records the token stream, parser.mappings and a
+perceptual hash of the generated image, plus how long each stage took. `check`
+re-runs the pipeline and diffs against the recorded snapshot with geometric
+tolerances, so small pixel drift from a rendering change passes but a field that
+moved, disappeared or changed type does not.
+
+`record` runs the Tokenizer with the settings /process uses (GRAYSCALE_PIPELINE and
+OCR_BATCHING from the environment, as in app.py). The settings are stored in the
+snapshot, and `check` re-runs with those unless a flag overrides them.
+
+    python snapshots.py record                    # (re)write ../snapshots/*.json
+    python snapshots.py check                     # diff, exit 1 on any mismatch
+    python snapshots.py check --box-tolerance 6 --hash-tolerance 12 contact_form
+    python snapshots.py record --no-text-layer --no-vector-layer   # pixel-only baseline
+    python snapshots.py check --text-layer --ocr-batching --dpi 200  # compare against it
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMS_DIR = os.path.join(BASE_DIR, "..", "forms")
+SNAPSHOT_DIR = os.path.join(BASE_DIR, "..", "snapshots")
+
+# Fixed profile so the generated image is reproducible
+PROFILE = {
+    "Full Name": "Juan Dela Cruz",
+    "Date of Birth": "1990-05-15",
+    "Gender": "Male",
+    "Nationality": "Filipino",
+    "Email Address": "juan.delacruz@example.com",
+    "Phone Number": "+63 912 345 6789",
+    "Alternate Phone Number": "+63 998 765 4321",
+    "Address": "123 Mabini Street, Quezon City",
+    "Current Employer": "San Miguel Corporation",
+    "Job Title": "Senior Software Engineer",
+    "Monthly Salary": "PHP 80,000",
+    "experience": "10",
+    "SSS Number": "34-5678901-2",
+    "TIN Number": "123-456-789",
+    "PhilHealth Number": "12-345678901-2",
+    "Pag-IBIG Number": "1234-5678-9012",
+    "Highest Education Level": "College",
+    "School": "University of the Philippines",
+    "Course/Program": "Electrical Engineering",
+    "Year Graduated": "2012",
+}
+
+SETTINGS = ("text_layer", "vector_layer", "grayscale", "ocr_batching", "dpi")
+
+
+def pipeline_settings():
+    """The Tokenizer settings /process runs with, read from the same environment variables as app.py."""
+    return {
+        "text_layer": True,
+        "vector_layer": True,
+        "grayscale": os.getenv("GRAYSCALE_PIPELINE", "1") == "1",
+        "ocr_batching": os.getenv("OCR_BATCHING", "0") == "1",
+        "dpi": 300,
+    }
+
+
+def run_pipeline(path, poppler_path=None, settings=None):
+    """
+    Run Tokenizer -> Parser -> Generator on one form and capture what it produced.
+
+    :param settings: Tokenizer keyword arguments overriding pipeline_settings()
+    """
+    from PIL import Image
+
+    from Token import Tokenizer
+    from Parser import Parser
+    from Generator import Generator
+    from template_library import dhash
+
+    settings = {**pipeline_settings(), **(settings or {})}
+    dpi = settings["dpi"]
+    timings = {}
+
+    started = time.perf_counter()
+    tokens, dimensions = Tokenizer(path, poppler_path=poppler_path, **settings).tokenize_file()
+    timings["tokenize_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    parser = Parser()
+    accepted, errors = parser(tokens)
+    timings["parse_ms"] = (time.perf_counter() - started) * 1000
+
+    image_hash = None
+    if accepted:
+        started = time.perf_counter()
+        output = io.BytesIO()
+        generator = Generator(
+            font_size=round(30 * dpi / 300), poppler_path=poppler_path, output_profile="png", render_dpi=dpi
+        )
+        generator.generate(path, parser.mappings, PROFILE, output)
+        timings["generate_ms"] = (time.perf_counter() - started) * 1000
+        output.seek(0)
+        with Image.open(output) as img:
+            image_hash = dhash(img)
+
+    return {
+        "form": os.path.basename(path),
+        "settings": settings,
+        "dimensions": [list(d) for d in dimensions],
+        "tokens": [
+            {"id": t.id, "type": t.type, "value": t.value, "bbox": list(t.bbox), "page": t.page}
+            for t in tokens
+        ],
+        "accepted": accepted,
+        "errors": errors,
+        "mappings": parser.mappings,
+        "image_hash": image_hash,
+        "timings": {stage: round(ms, 1) for stage, ms in timings.items()},
+    }
+
+
+def _box_diff(a, b):
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def diff(expected, actual, box_tolerance, hash_tolerance):
+    """Return a list of human readable differences (empty when the snapshot matches)."""
+    from template_library import hamming
+
+    problems = []
+
+    if expected["accepted"] != actual["accepted"]:
+        problems.append(f"accepted: {expected['accepted']} -> {actual['accepted']}")
+
+    # Once a token was added or dropped every later pair is offset, so a count mismatch
+    # is reported with the first token that differs instead of one line per token
+    exp_tokens, act_tokens = expected["tokens"], actual["tokens"]
+    if len(exp_tokens) != len(act_tokens):
+        problems.append(f"token count: {len(exp_tokens)} -> {len(act_tokens)}")
+        for i, (exp, act) in enumerate(zip(exp_tokens, act_tokens)):
+            if exp["type"] != act["type"] or exp["value"] != act["value"]:
+                problems.append(
+                    f"first differing token {i}: {exp['type']} {exp['value']!r} -> {act['type']} {act['value']!r}"
+                )
+                break
+    else:
+        for i, (exp, act) in enumerate(zip(exp_tokens, act_tokens)):
+            if exp["type"] != act["type"] or exp["value"] != act["value"]:
+                problems.append(f"token {i}: {exp['type']} {exp['value']!r} -> {act['type']} {act['value']!r}")
+            elif _box_diff(exp["bbox"], act["bbox"]) > box_tolerance:
+                problems.append(f"token {i} ({exp['value']!r}) moved: {exp['bbox']} -> {act['bbox']}")
+
+    exp_maps, act_maps = expected["mappings"], actual["mappings"]
+    if len(exp_maps) != len(act_maps):
+        problems.append(f"mapping count: {len(exp_maps)} -> {len(act_maps)}")
+        for exp, act in zip(exp_maps, act_maps):
+            if (exp["section"], exp["label"]) != (act["section"], act["label"]):
+                problems.append(
+                    f"first differing mapping: {exp['section']}/{exp['label']} -> {act['section']}/{act['label']}"
+                )
+                break
+    else:
+        for exp, act in zip(exp_maps, act_maps):
+            if (exp["section"], exp["label"]) != (act["section"], act["label"]):
+                problems.append(f"mapping: {exp['section']}/{exp['label']} -> {act['section']}/{act['label']}")
+                continue
+            exp_box = [exp["fill_target"][k] for k in "xywh"]
+            act_box = [act["fill_target"][k] for k in "xywh"]
+            if _box_diff(exp_box, act_box) > box_tolerance:
+                problems.append(f"fill_target of {exp['label']!r} moved: {exp_box} -> {act_box}")
+
+    if expected["image_hash"] and actual["image_hash"]:
+        distance = hamming(expected["image_hash"], actual["image_hash"])
+        if distance > hash_tolerance:
+            problems.append(f"generated image hash distance {distance} > {hash_tolerance}")
+    elif expected["image_hash"] != actual["image_hash"]:
+        problems.append("generated image missing")
+
+    return problems
+
+
+def _snapshot_path(form_path):
+    name = os.path.splitext(os.path.basename(form_path))[0]
+    return os.path.join(SNAPSHOT_DIR, f"{name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or check golden pipeline snapshots")
+    parser.add_argument("command", choices=["record", "check"])
+    parser.add_argument("forms", nargs="*", help="Form names (without extension); default: all of ../forms")
+    parser.add_argument("--box-tolerance", type=int, default=4, help="Max per-coordinate drift in pixels")
+    parser.add_argument("--hash-tolerance", type=int, default=8, help="Max Hamming distance of the output hash")
+    # Tokenizer settings; unset flags fall back to the snapshot's (check) or /process's (record)
+    parser.add_argument("--text-layer", action=argparse.BooleanOptionalAction,
+                        help="Read words from the PDF text layer (--no-text-layer: OCR every page)")
+    parser.add_argument("--vector-layer", action=argparse.BooleanOptionalAction,
+                        help="Read field boxes from PDF drawing operators (--no-vector-layer: from pixels)")
+    parser.add_argument("--grayscale", action=argparse.BooleanOptionalAction,
+                        help="Render pages as 8-bit grayscale (default: GRAYSCALE_PIPELINE)")
+    parser.add_argument("--ocr-batching", action=argparse.BooleanOptionalAction,
+                        help="OCR text regions through mosaics (default: OCR_BATCHING)")
+    parser.add_argument("--dpi", type=int, help="Render DPI (default 300)")
+    args = parser.parse_args()
+    overrides = {name: getattr(args, name) for name in SETTINGS if getattr(args, name) is not None}
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    poppler_path = os.getenv("POPPLER_PATH")
+    if os.getenv("PYTESSERACT_PATH"):
+        import pytesseract
+
+        pytesseract.pytesseract.tesseract_cmd = os.getenv("PYTESSERACT_PATH")
+
+    form_paths = sorted(glob.glob(os.path.join(FORMS_DIR, "*.pdf")))
+    if args.forms:
+        form_paths = [p for p in form_paths if os.path.splitext(os.path.basename(p))[0] in args.forms]
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    failed = 0
+
+    for path in form_paths:
+        snapshot = _snapshot_path(path)
+
+        if args.command == "record":
+            actual = run_pipeline(path, poppler_path, overrides)
+            timings = ", ".join(f"{stage} {ms}" for stage, ms in actual["timings"].items())
+            with open(snapshot, "w") as f:
+                json.dump(actual, f, indent=2, ensure_ascii=False)
+            print(f"recorded {actual['form']}: {len(actual['tokens'])} tokens, "
+                  f"{len(actual['mappings'])} mappings ({timings})")
+            continue
+
+        if not os.path.exists(snapshot):
+            print(f"MISSING {os.path.basename(path)}: no snapshot, run `record` first")
+            failed += 1
+            continue
+
+        with open(snapshot) as f:
+            expected = json.load(f)
+
+        recorded = {**pipeline_settings(), **expected.get("settings", {})}
+        actual = run_pipeline(path, poppler_path, {**recorded, **overrides})
+        changed = [f"{name} {recorded[name]} -> {value}" for name, value in actual["settings"].items()
+                   if recorded[name] != value]
+        if changed:
+            print(f"     {actual['form']} settings differ from the snapshot: {', '.join(changed)}")
+
+        problems = diff(expected, actual, args.box_tolerance, args.hash_tolerance)
+        speedups = ", ".join(
+            f"{stage} {expected['timings'].get(stage, '-')} -> {ms}"
+            for stage, ms in actual["timings"].items()
+        )
+        if problems:
+            failed += 1
+            print(f"FAIL {actual['form']} ({speedups})")
+            for problem in problems:
+                print(f"    {problem}")
+        else:
+            print(f"ok   {actual['form']} ({speedups})")
+
+    if args.command == "check":
+        print(f"\n{len(form_paths) - failed}/{len(form_paths)} forms match their snapshots")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
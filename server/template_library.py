@@ -0,0 +1,330 @@
+"""
+Library of forms we have already parsed, so a re-scan, photo or re-export of the same
+form can reuse its mappings instead of going through OCR again.
+
+Each template keeps a perceptual hash per page (cheap to compute from a low resolution
+render) and the layout of its FIELD_SPACE boxes. An upload whose hashes are close to a
+template's is confirmed by matching its own field boxes (vector or OpenCV detection, no
+OCR) against the stored layout; the fitted scale/offset then moves the stored fill_target
+boxes onto the new upload. A byte-identical upload is found by its content key alone and
+skips the fingerprint as well.
+
+A form that an existing template already covers is not stored again, and only the newest
+MAX_TEMPLATES are kept, which bounds memory and the linear hash scan of every lookup.
+
+Templates are tagged with PIPELINE_VERSION; after a Tokenizer/Parser change that alters
+mappings, bumping it retires every stored template. A near-duplicate match is only used
+when the template's labels appear in the upload's text layer (on pages that have one), so
+a revised form that renamed a field in the same box is parsed afresh.
+"""
+import os
+import re
+import threading
+
+import database
+
+FINGERPRINT_DPI = 36
+MAX_FINGERPRINT_PAGES = 4
+MAX_TEMPLATES = int(os.getenv("MAX_TEMPLATES", "500"))
+
+# Bump when a Tokenizer or Parser change alters the mappings parsed from the same form
+# (together with output_cache.CACHE_VERSION, which keys the generated files)
+PIPELINE_VERSION = 1
+
+
+def dhash(image, size=16):
+    """
+    Difference hash of a PIL image: one bit per horizontally adjacent pixel pair of a
+    (size + 1) x size grayscale thumbnail. Robust to rescans, compression and small shifts.
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def fingerprint(path, poppler_path=None):
+    """Perceptual hashes of the first pages of a PDF or image, from a low resolution render."""
+    if path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+
+        pages = convert_from_path(
+            path,
+            FINGERPRINT_DPI,
+            grayscale=True,
+            last_page=MAX_FINGERPRINT_PAGES,
+            poppler_path=poppler_path
+        )
+        return [dhash(page) for page in pages]
+
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # JPEG can decode straight at 1/8 scale
+        img.draft("L", (img.width // 8, img.height // 8))
+        return [dhash(img)]
+
+
+def _center(box):
+    x, y, w, h = box
+    return x + w / 2, y + h / 2
+
+
+def _fit_axis(pairs):
+    """Least-squares scale and offset for new = scale * old + offset."""
+    n = len(pairs)
+    mean_old = sum(o for o, _ in pairs) / n
+    mean_new = sum(v for _, v in pairs) / n
+    var = sum((o - mean_old) ** 2 for o, _ in pairs)
+    if var == 0:
+        return 1.0, mean_new - mean_old
+    scale = sum((o - mean_old) * (v - mean_new) for o, v in pairs) / var
+    return scale, mean_new - scale * mean_old
+
+
+def _match(layout, boxes, transform, max_dist):
+    sx, tx, sy, ty = transform
+    matches = []
+    for old in layout:
+        ox, oy = _center(old)
+        px, py = sx * ox + tx, sy * oy + ty
+        best, best_dist = None, max_dist
+        for new in boxes:
+            nx, ny = _center(new)
+            dist = ((nx - px) ** 2 + (ny - py) ** 2) ** 0.5
+            if dist <= best_dist:
+                best, best_dist = new, dist
+        if best is not None:
+            matches.append((old, best))
+    return matches
+
+
+def align(layout, dimensions, boxes, new_dimensions, tolerance=0.02, iterations=3):
+    """
+    Fit x' = sx * x + tx, y' = sy * y + ty that carries the stored layout onto the boxes
+    detected in a new upload.
+
+    :param tolerance: Max distance between matched box centres, as a fraction of page width
+    :return: (transform, matched_fraction, mean_error_px); transform is None if nothing matched
+    """
+    if not layout or not boxes:
+        return None, 0.0, None
+
+    old_h, old_w = dimensions[0]
+    new_h, new_w = new_dimensions[0]
+    max_dist = tolerance * new_w
+
+    # Start from the page size ratio (rescans differ mainly in resolution), either as is
+    # or shifted so the top-left field boxes line up (different margins / crop)
+    sx, sy = new_w / old_w, new_h / old_h
+    seeds = [
+        (sx, 0.0, sy, 0.0),
+        (sx, min(b[0] for b in boxes) - sx * min(b[0] for b in layout),
+         sy, min(b[1] for b in boxes) - sy * min(b[1] for b in layout)),
+    ]
+    transform = max(seeds, key=lambda seed: len(_match(layout, boxes, seed, max_dist)))
+
+    matches = []
+    for _ in range(iterations):
+        matches = _match(layout, boxes, transform, max_dist)
+        if len(matches) < 2:
+            return None, len(matches) / len(layout), None
+
+        # Fit on both edges of every matched box so widths/heights constrain the scale
+        x_pairs = [(o[0], n[0]) for o, n in matches] + [(o[0] + o[2], n[0] + n[2]) for o, n in matches]
+        y_pairs = [(o[1], n[1]) for o, n in matches] + [(o[1] + o[3], n[1] + n[3]) for o, n in matches]
+        sx, tx = _fit_axis(x_pairs)
+        sy, ty = _fit_axis(y_pairs)
+        transform = (sx, tx, sy, ty)
+
+    matches = _match(layout, boxes, transform, max_dist)
+    if not matches:
+        return None, 0.0, None
+
+    sx, tx, sy, ty = transform
+    errors = [
+        abs(sx * o[0] + tx - n[0]) + abs(sy * o[1] + ty - n[1])
+        for o, n in matches
+    ]
+    return transform, len(matches) / len(layout), sum(errors) / len(errors)
+
+
+def label_words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def _page_of(y, dimensions):
+    """Index of the page a y coordinate falls on, in stacked-page coordinates."""
+    top = 0
+    for index, (height, _) in enumerate(dimensions):
+        top += height
+        if y < top:
+            return index
+    return len(dimensions) - 1
+
+
+def labels_present(mappings, dimensions, page_words):
+    """
+    True if the words of every label in `mappings` (in the upload's coordinates) occur in
+    the text layer of the page its fill target is on. Pages without a text layer
+    (page_words is None, or None for that page) are not checked.
+    """
+    if not page_words:
+        return True
+    for item in mappings:
+        page = _page_of(item["fill_target"]["y"], dimensions)
+        words = page_words[page] if page < len(page_words) else None
+        if words is not None and not set(label_words(item["label"])) <= words:
+            return False
+    return True
+
+
+def transform_mappings(mappings, transform):
+    sx, tx, sy, ty = transform
+    moved = []
+    for item in mappings:
+        box = item["fill_target"]
+        moved.append({
+            **item,
+            "fill_target": {
+                "x": round(sx * box["x"] + tx),
+                "y": round(sy * box["y"] + ty),
+                "w": round(sx * box["w"]),
+                "h": round(sy * box["h"]),
+            }
+        })
+    return moved
+
+
+class TemplateLibrary:
+
+    def __init__(self, max_distance=24, min_match=0.85, tolerance=0.02, max_error=12,
+                 max_templates=MAX_TEMPLATES):
+        """
+        :param max_distance: Max Hamming distance (of 256 bits) between page hashes
+        :param min_match: Fraction of stored field boxes that must be found in the upload
+        :param tolerance: Box matching radius as a fraction of page width
+        :param max_error: Max mean corner error (pixels) after alignment
+        :param max_templates: Templates kept; the oldest are evicted beyond that
+        """
+        self.max_distance = max_distance
+        self.min_match = min_match
+        self.tolerance = tolerance
+        self.max_error = max_error
+        self.max_templates = max_templates
+
+        self._templates = []
+        self._by_content = {}
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        # Pick up templates other workers have added since we last looked
+        with self._lock:
+            new = database.load_templates(self._last_id, PIPELINE_VERSION)
+            if new:
+                for template in new:
+                    template["page_bits"] = [int(h, 16) for h in template["page_hashes"]]
+                self._templates.extend(new)
+                self._last_id = new[-1]["id"]
+                for template in new:
+                    if template["content_key"]:
+                        self._by_content.setdefault(template["content_key"], template)
+
+                # Every worker evicts the same (oldest) rows, so keeping the newest ids matches the table
+                if len(self._templates) > self.max_templates:
+                    self._templates = self._templates[-self.max_templates:]
+                    self._by_content = {}
+                    for template in self._templates:
+                        if template["content_key"]:
+                            self._by_content.setdefault(template["content_key"], template)
+            return list(self._templates)
+
+    def _candidates(self, page_hashes):
+        page_bits = [int(h, 16) for h in page_hashes]
+        candidates = []
+        for template in self._refresh():
+            stored = template["page_bits"]
+            if len(stored) != len(page_bits):
+                continue
+            distance = max(bin(a ^ b).count("1") for a, b in zip(stored, page_bits))
+            if distance <= self.max_distance:
+                candidates.append((distance, template))
+        candidates.sort(key=lambda c: c[0])
+        return [template for _, template in candidates]
+
+    def _alignments(self, candidates, boxes, dimensions):
+        """Yield (template, transform) for each candidate whose layout aligns with `boxes`."""
+        for template in candidates:
+            transform, matched, error = align(
+                template["layout"], template["dimensions"], boxes, dimensions, self.tolerance
+            )
+            if transform is None or matched < self.min_match or error > self.max_error:
+                continue
+            # The upload shouldn't have many more fields than the template either
+            if len(boxes) > len(template["layout"]) / self.min_match:
+                continue
+            yield template, transform
+
+    def lookup_exact(self, content_key):
+        """Mappings of a template learned from exactly this file, or None."""
+        self._refresh()
+        template = self._by_content.get(content_key)
+        return template["mappings"] if template else None
+
+    def lookup(self, page_hashes, tokenizer):
+        """
+        Find a stored template for the upload behind `tokenizer`.
+
+        :param page_hashes: fingerprint() of the upload
+        :param tokenizer: Tokenizer for the upload; only its field-space detection is used
+        :return: mappings moved into the upload's coordinates, or None
+        """
+        candidates = self._candidates(page_hashes)
+        if not candidates:
+            return None
+
+        tokens, dimensions = tokenizer.detect_field_spaces()
+        page_words = None
+
+        for template, transform in self._alignments(candidates, [t.bbox for t in tokens], dimensions):
+            mappings = transform_mappings(template["mappings"], transform)
+            if page_words is None:
+                page_words = tokenizer.text_layer_words() or []
+            if labels_present(mappings, dimensions, page_words):
+                return mappings
+
+        return None
+
+    def add(self, page_hashes, tokens, dimensions, mappings, content_key=None):
+        """
+        Remember a successfully parsed form, unless a stored template already covers it
+        (e.g. two workers parsed the same new form at once).
+
+        :return: id of the new or covering template, None if there was nothing to store
+        """
+        layout = [t.bbox for t in tokens if t.type == "FIELD_SPACE"]
+        if not layout or not mappings:
+            return None
+
+        labels = [item["label"] for item in mappings]
+        for template, _ in self._alignments(self._candidates(page_hashes), layout, dimensions):
+            if [item["label"] for item in template["mappings"]] == labels:
+                return template["id"]
+
+        template_id = database.save_template(
+            page_hashes, layout, dimensions, mappings, content_key, PIPELINE_VERSION
+        )
+        database.prune_templates(self.max_templates, PIPELINE_VERSION)
+        return template_id
@@ -0,0 +1,138 @@
+"""
+Content-addressed store for uploaded documents.
+
+An upload is hashed (SHA-256) while it streams to a temporary file and then kept at
+<root>/<hash[:2]>/<hash[2:4]>/<hash>.<ext>. Identical uploads share one file, and
+same-named files from different users no longer overwrite each other. The hash also
+keys the output cache and the template library, so repeated work on an identical
+form is skipped.
+
+The same bytes uploaded under another extension are a separate file (the pipeline
+picks its decoder by extension), so files are keyed by (hash, extension).
+
+The uploads table counts the references to each file: one per document (a session's
+current upload) and one per running job. A background thread expires documents of
+sessions that never came back and deletes files that have been unreferenced for a
+grace period. Profiles (the users table) and generated outputs (the output cache)
+expire with the same retention.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+import database
+import preflight
+
+UPLOAD_RETENTION_HOURS = float(os.getenv("UPLOAD_RETENTION_HOURS", "24"))
+UPLOAD_GC_GRACE = float(os.getenv("UPLOAD_GC_GRACE", "600"))
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "300"))
+
+
+class UploadStore:
+
+    def __init__(self, root, outputs=None):
+        """
+        :param outputs: Optional OutputCache whose stale files collect() removes as well
+        """
+        self.root = root
+        self.outputs = outputs
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._gc_pid = None
+        self._gc_lock = threading.Lock()
+
+    def path_for(self, content_hash, ext):
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], f"{content_hash}.{ext}")
+
+    def save(self, stream, ext, check=None):
+        """
+        Store an upload stream and take a reference to it for the caller.
+
+        :param ext: File extension (lowercase, validated by the caller)
+        :param check: Optional callable run on the received file before it is stored,
+                      e.g. preflight.check; its exceptions propagate
+        :return: (content_hash, path)
+        """
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.{ext}")
+        digest = hashlib.sha256()
+        size = preflight.save_stream(stream, tmp_path, digest=digest)
+
+        registered = False
+        try:
+            if check is not None:
+                check(tmp_path)
+
+            content_hash = digest.hexdigest()
+            path = self.path_for(content_hash, ext)
+
+            # Reference first: a collection of the same hash either finished before
+            # (file gone, stored again below) or has to wait for this one
+            database.register_upload(content_hash, ext, path, size)
+            registered = True
+
+            if os.path.exists(path):
+                os.remove(tmp_path)  # already stored
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if registered:
+                database.release_upload(content_hash, ext)
+            raise
+
+        return content_hash, path
+
+    def retain(self, content_hash, ext):
+        return database.retain_upload(content_hash, ext)
+
+    def release(self, content_hash, ext):
+        database.release_upload(content_hash, ext)
+
+    def collect(self):
+        """One garbage collection pass. Returns the number of files deleted."""
+        database.expire_documents(UPLOAD_RETENTION_HOURS * 3600)
+        database.expire_profiles(UPLOAD_RETENTION_HOURS * 3600)
+        if self.outputs is not None:
+            self.outputs.expire(UPLOAD_RETENTION_HOURS * 3600)
+        removed = database.collect_uploads(UPLOAD_GC_GRACE, self._remove)
+
+        # Temporary files of uploads that died mid-stream
+        cutoff = time.time() - UPLOAD_GC_GRACE
+        with os.scandir(self.tmp_dir) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def start_gc(self):
+        """Run collect() every UPLOAD_GC_INTERVAL seconds in a daemon thread (once per process)."""
+        with self._gc_lock:
+            # Threads don't survive fork, so gunicorn workers each start their own
+            if self._gc_pid == os.getpid():
+                return
+            self._gc_pid = os.getpid()
+
+        threading.Thread(target=self._gc_loop, name="upload-gc", daemon=True).start()
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(UPLOAD_GC_INTERVAL)
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Warning: upload garbage collection failed: {e}")
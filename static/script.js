@@ -329,21 +329,35 @@ async processDocument() {
     statusDiv.innerHTML = `<span>Processing document...</span>`;
 
     try {
-        const res = await fetch("/process", { method: "POST" });
-        if (!res.ok) {
+        // The server answers 304 when the last result still matches (same form, profile and settings)
+        const headers = this.lastResult ? { 'If-None-Match': this.lastResult.etag } : {};
+        const res = await fetch("/process", { method: "POST", headers });
+        if (res.status !== 304 && !res.ok) {
             const data = await res.json();
             showToast(data.errors?.join(',') || "Processing failed", "error");
             return;
         }
 
         // Convert response to blob
-        const blob = await res.blob();
-        const imgUrl = URL.createObjectURL(blob);
-
-        // Show preview
+        let blob;
+        if (res.status === 304) {
+            blob = this.lastResult.blob;
+        } else {
+            blob = await res.blob();
+            const etag = res.headers.get('ETag');
+            this.lastResult = etag ? { etag, blob } : null;
+        }
+        if (this.resultUrl) URL.revokeObjectURL(this.resultUrl);
+        const resultUrl = URL.createObjectURL(blob);
+        this.resultUrl = resultUrl;
+
+        // Show preview; a PDF output profile can't be shown in an <img>
+        const preview = blob.type === 'application/pdf'
+            ? `<embed src="${resultUrl}" type="application/pdf" style="width:100%; height:80vh; margin-bottom:1rem"/>`
+            : `<img src="${resultUrl}" style="max-width:100%; margin-bottom:1rem"/>`;
         document.getElementById('filledDocument').innerHTML = `
             <div style="text-align:center;">
-                <img src="${imgUrl}" style="max-width:100%; margin-bottom:1rem"/>
+                ${preview}
                 <br/>
                 <button id="downloadFilledFormBtn">Download Filled Form</button>
             </div>
@@ -352,8 +366,9 @@ async processDocument() {
         // Download functionality
         document.getElementById('downloadFilledFormBtn').addEventListener('click', () => {
             const a = document.createElement('a');
-            a.href = imgUrl;
-            a.download = 'filled_form.jpg';  // filename for download
+            a.href = resultUrl;
+            const ext = { 'image/png': 'png', 'application/pdf': 'pdf' }[blob.type] || 'jpg';
+            a.download = `filled_form.${ext}`;  // filename for download
             document.body.appendChild(a);
             a.click();
             document.body.removeChild(a);